@@ -462,16 +462,15 @@ class _CameraPageState extends State<CameraPage> with SingleTickerProviderStateM
   Future<void> _analyzeWithGPT(File imageFile) async {
     try {
       final bytes = await imageFile.readAsBytes();
-      final base64Image = base64Encode(bytes);
 
+      // 📦 Send the raw JPEG bytes (no base64 inflation); caption rides in the query string
       final response = await http
           .post(
-        Uri.parse('http://192.168.68.61:5000/analyze'),
-        headers: {'Content-Type': 'application/json'},
-        body: jsonEncode({
-          'image': base64Image,
-          'caption': _userCaption.trim(),
-        }),
+        Uri.parse('http://192.168.68.61:5000/analyze').replace(
+          queryParameters: {'caption': _userCaption.trim()},
+        ),
+        headers: {'Content-Type': 'image/jpeg'},
+        body: bytes,
       )
           .timeout(const Duration(seconds: 120));
 
@@ -0,0 +1,100 @@
+import math
+import os
+import threading
+import time
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded in-flight slots plus a bounded wait queue for long-running analyses.
+
+    Up to `max_in_flight` requests run at once. Up to `max_queue` more wait (at most
+    `queue_timeout` seconds) for a slot. Anything beyond that is rejected right away
+    with 429, and a queued request that times out gets 503, so clients see
+    backpressure instead of sitting in an invisible socket backlog until their own
+    timeout fires. Retry-After comes from a moving average of how long an admitted
+    request holds its slot. Once `start_draining` is called, new requests get 503 and
+    in-flight ones are left to finish.
+    """
+
+    def __init__(self, max_in_flight=8, max_queue=16, queue_timeout=10.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self.draining = False
+        self._avg_hold = 30.0  # Seconds; seeded with a typical uncached analysis
+        self._cond = threading.Condition()
+
+    def retry_after(self):
+        # Roughly how long until the requests ahead of a newcomer have drained
+        waves = (self.queued + 1) / max(1, self.max_in_flight)
+        return max(1, min(120, math.ceil(self._avg_hold * waves)))
+
+    def acquire(self):
+        """Take a slot, waiting in the queue if needed. Raises AdmissionRejected."""
+        with self._cond:
+            if self.draining:
+                raise AdmissionRejected(503, "Server is shutting down", self.retry_after())
+
+            if self.in_flight < self.max_in_flight and self.queued == 0:
+                self.in_flight += 1
+                return time.monotonic()
+
+            if self.queued >= self.max_queue:
+                raise AdmissionRejected(429, "Server is busy", self.retry_after())
+
+            self.queued += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.in_flight >= self.max_in_flight or self.draining:
+                    remaining = deadline - time.monotonic()
+                    if self.draining:
+                        raise AdmissionRejected(503, "Server is shutting down", self.retry_after())
+                    if remaining <= 0:
+                        raise AdmissionRejected(503, "Timed out waiting for capacity", self.retry_after())
+                    self._cond.wait(remaining)
+            finally:
+                self.queued -= 1
+
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, admitted_at):
+        with self._cond:
+            self.in_flight -= 1
+            held = time.monotonic() - admitted_at
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * held
+            self._cond.notify()
+
+    def start_draining(self):
+        with self._cond:
+            self.draining = True
+            self._cond.notify_all()
+
+    def wait_idle(self, timeout):
+        """Block until nothing is in flight (or timeout). Returns True when idle."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.in_flight > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(min(remaining, 1.0))
+            return True
+
+
+def admission_from_env():
+    return AdmissionController(
+        max_in_flight=int(os.getenv("MAX_IN_FLIGHT_ANALYSES", "8")),
+        max_queue=int(os.getenv("MAX_QUEUED_ANALYSES", "16")),
+        queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10")),
+    )
@@ -0,0 +1,69 @@
+"""Analyze many images in-process with the same pipeline as POST /analyze/batch.
+
+    python batch_analyze.py photos/ extra.jpg --concurrency 4 --output results.ndjson
+
+Writes one NDJSON line per image (same shape as the /analyze/batch "item" events) and
+a final summary line. Pipeline logs go to stderr, so stdout carries only those lines.
+Run it from server/ so secrets.env is picked up.
+"""
+import argparse
+import os
+import sys
+
+import telemetry
+
+# Before importing server, which already logs while it sets up caches
+telemetry.set_log_stream(sys.stderr)
+
+from server import BATCH_DEFAULT_WORKERS, BATCH_MAX_WORKERS, ndjson, run_batch
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".heic"}
+
+
+def collect_images(paths):
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                    images.append(os.path.join(path, name))
+        else:
+            images.append(path)
+    return images
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch-analyze dish photos.")
+    parser.add_argument("paths", nargs="+", help="Image files or directories of images")
+    parser.add_argument("--caption", default="", help="Caption applied to every image")
+    parser.add_argument(
+        "--concurrency", type=int, default=BATCH_DEFAULT_WORKERS,
+        help=f"Images analyzed in parallel (max {BATCH_MAX_WORKERS})",
+    )
+    parser.add_argument("--output", help="NDJSON output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    paths = collect_images(args.paths)
+    if not paths:
+        parser.error("no images found")
+
+    # Images are read lazily by the workers, so memory stays bounded by --concurrency
+    items = [{"id": path, "path": path, "caption": args.caption} for path in paths]
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    succeeded = 0
+    try:
+        for item in run_batch(items, args.concurrency):
+            succeeded += item["status"] == 200
+            out.write(ndjson("item", **item))
+            out.flush()
+        out.write(ndjson("done", total=len(items), succeeded=succeeded, failed=len(items) - succeeded))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    return 0 if succeeded == len(items) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
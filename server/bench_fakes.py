@@ -0,0 +1,294 @@
+"""Local stand-ins for the OpenAI chat-completions and Cloudinary upload APIs.
+
+Used by benchmark.py so the /analyze pipeline can be load-tested without API credits
+or network access. Both fakes speak just enough of the real wire format for the
+official clients:
+
+  * POST /v1/chat/completions          (plain and `stream: true` SSE responses)
+  * POST /v1_1/<cloud>/image/upload    and    POST /v1_1/<cloud>/image/destroy
+
+Latency is drawn from a configurable distribution per call type, and a share of calls
+can fail (HTTP 500) or, for OpenAI, return malformed JSON content so the
+`json.loads` fallback paths get exercised.
+"""
+import base64
+import io
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow, image token estimates assume a typical preprocessed photo
+    Image = None
+
+DISH_NAMES = [
+    "Chicken Alfredo", "Margherita Pizza", "Beef Tacos", "Pad Thai", "Caesar Salad",
+    "Chicken Tikka Masala", "Sushi Platter", "Pancakes", "Ramen", "Falafel Wrap",
+]
+
+FAKE_RECIPE = {
+    "title": "Fake Recipe",
+    "ingredients": ["1 cup flour", "2 eggs", "1 tbsp olive oil"],
+    "instructions": ["Mix everything.", "Cook for 10 minutes.", "Serve warm."],
+    "servings": 2,
+    "prepTime": "10 minutes",
+    "cookTime": "20 minutes",
+    "nutrition": {"calories": 450, "protein": "20g", "carbs": "50g", "fat": "15g"},
+}
+
+
+def parse_latency(spec):
+    """Turn a latency spec into a sampler returning seconds.
+
+      "0.5"                constant
+      "uniform:0.2,1.5"    uniform between the bounds
+      "normal:1.0,0.3"     normal(mean, stddev), clipped at 0
+      "lognormal:0.0,0.5"  lognormal(mu, sigma), i.e. median e^mu seconds
+    """
+    kind, _, params = spec.partition(":")
+    if not params:
+        value = float(kind)
+        return lambda: value
+
+    a, b = (float(x) for x in params.split(","))
+    if kind == "uniform":
+        return lambda: random.uniform(a, b)
+    if kind == "normal":
+        return lambda: max(0.0, random.normalvariate(a, b))
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(a, b)
+    raise ValueError(f"Unknown latency distribution: {spec!r}")
+
+
+def image_size(url):
+    """(width, height) of a data-URL image, or None if it can't be read."""
+    if Image is None or not url.startswith("data:"):
+        return None
+    try:
+        with Image.open(io.BytesIO(base64.b64decode(url.partition(",")[2]))) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+def image_tokens(image_url):
+    """Vision input tokens the way OpenAI bills them: a flat 85 at low detail, otherwise
+    85 plus 170 per 512px tile after scaling to fit 2048px and a 768px shortest side."""
+    if image_url.get("detail") == "low":
+        return 85
+    width, height = image_size(image_url.get("url", "")) or (1536, 1152)
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def prompt_tokens(messages):
+    """~4 characters per text token; images cost their tile estimate, not their base64 size."""
+    chars, tokens = 0, 0
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content:
+            if part.get("type") == "image_url":
+                tokens += image_tokens(part.get("image_url") or {})
+            else:
+                chars += len(part.get("text", ""))
+    return tokens + chars // 4
+
+
+class FakeConfig:
+    def __init__(
+        self,
+        identify_latency="uniform:0.5,1.5",
+        generate_latency="uniform:2,6",
+        upload_latency="uniform:0.3,1.2",
+        failure_rate=0.0,
+        malformed_rate=0.0,
+        unknown_rate=0.1,
+        seed=None,
+    ):
+        self.identify_latency = parse_latency(identify_latency)
+        self.generate_latency = parse_latency(generate_latency)
+        self.upload_latency = parse_latency(upload_latency)
+        self.failure_rate = failure_rate
+        self.malformed_rate = malformed_rate
+        self.unknown_rate = unknown_rate
+        self.random = random.Random(seed)
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def chance(self, rate):
+        with self._lock:
+            return self.random.random() < rate
+
+    def pick(self, options):
+        with self._lock:
+            return self.random.choice(options)
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    config = None  # Set on the per-server subclass
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output readable
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeOpenAIHandler(_Handler):
+    def do_POST(self):
+        body = self.read_body()
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json({"error": {"message": "not found"}}, 404)
+            return
+
+        request = json.loads(body or b"{}")
+        messages = request.get("messages", [])
+        user_content = messages[-1].get("content") if messages else ""
+        system_content = messages[0].get("content", "") if messages else ""
+
+        if isinstance(user_content, list):
+            kind, latency = "identify", self.config.identify_latency
+        elif "Format:" in system_content:
+            kind, latency = "recipe", self.config.generate_latency
+        else:
+            kind, latency = "description", self.config.generate_latency
+
+        time.sleep(latency())
+        self.config.count(f"openai_{kind}")
+
+        if self.config.chance(self.config.failure_rate):
+            self.config.count(f"openai_{kind}_failed")
+            self.send_json({"error": {"message": "fake upstream failure", "type": "server_error"}}, 500)
+            return
+
+        content = self.fake_content(kind, user_content)
+        if self.config.chance(self.config.malformed_rate):
+            self.config.count(f"openai_{kind}_malformed")
+            content = "```json\n" + content[: max(1, len(content) // 2)]
+
+        prompt_token_count = prompt_tokens(messages)
+        completion_tokens = max(1, len(content) // 4)
+        if request.get("stream"):
+            self.send_stream(content, prompt_token_count, completion_tokens)
+        else:
+            self.send_json({
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "gpt-4o"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_token_count,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_token_count + completion_tokens,
+                },
+            })
+
+    def fake_content(self, kind, user_content):
+        if kind == "identify":
+            if self.config.chance(self.config.unknown_rate):
+                return json.dumps({"title": "unknown"})
+            return json.dumps({"title": self.config.pick(DISH_NAMES)})
+        if kind == "recipe":
+            return json.dumps(FAKE_RECIPE)
+        dish = re.search(r"'([^']+)'", user_content or "")
+        name = dish.group(1) if dish else "This dish"
+        return f"{name} is a fake benchmark dish. It is savory, rich and perfectly textured."
+
+    def send_stream(self, content, prompt_tokens, completion_tokens):
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def event(choices, usage=None):
+            payload = {
+                "id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": "gpt-4o", "choices": choices, "usage": usage,
+            }
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        for word in re.findall(r"\S+\s*", content):
+            event([{"index": 0, "delta": {"content": word}, "finish_reason": None}])
+        event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        event([], {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        })
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+class FakeCloudinaryHandler(_Handler):
+    def do_POST(self):
+        body = self.read_body()
+        action = self.path.rstrip("/").rsplit("/", 1)[-1]
+
+        if action == "destroy":
+            self.config.count("cloudinary_destroy")
+            self.send_json({"result": "ok"})
+            return
+        if action != "upload":
+            self.send_json({"error": {"message": "not found"}}, 404)
+            return
+
+        time.sleep(self.config.upload_latency())
+        self.config.count("cloudinary_upload")
+        if self.config.chance(self.config.failure_rate):
+            self.config.count("cloudinary_upload_failed")
+            self.send_json({"error": {"message": "fake upload failure"}}, 500)
+            return
+
+        match = re.search(rb'name="public_id"\r\n\r\n([^\r]+)', body)
+        public_id = match.group(1).decode("utf-8") if match else uuid.uuid4().hex[:10]
+        folder = re.search(rb'name="folder"\r\n\r\n([^\r]+)', body)
+        if folder:
+            public_id = f"{folder.group(1).decode('utf-8')}/{public_id}"
+        self.send_json({
+            "public_id": public_id,
+            "bytes": len(body),
+            "secure_url": f"https://res.cloudinary.example/fake/image/upload/{public_id}.jpg",
+        })
+
+
+def start_fake(handler_class, config, host="127.0.0.1", port=0):
+    """Serve a fake on a background thread. Returns (server, base_url)."""
+    handler = type(handler_class.__name__, (handler_class,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=handler_class.__name__, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
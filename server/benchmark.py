@@ -0,0 +1,357 @@
+"""Offline load test for the server against local OpenAI/Cloudinary stand-ins.
+
+    python benchmark.py --concurrency 1,4,16 --requests 50
+    python benchmark.py --images ~/dish_photos --scenario analyze --failure-rate 0.05 --malformed-rate 0.1
+    python benchmark.py --gunicorn --concurrency 8,32 --output bench_results/gthread.json
+
+Starts the fakes from bench_fakes.py, launches server.py (or gunicorn) pointed at them,
+drives /analyze and /cloudinary-signature at each concurrency level and writes a JSON
+report with p50/p95/p99 latency, requests/sec, status counts, peak server RSS and a
+per-stage breakdown taken from the Server-Timing header.
+
+By default the dish cache and image index are disabled so every request pays for the
+full pipeline; pass --warm to measure with them on.
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_fakes import FakeCloudinaryHandler, FakeConfig, FakeOpenAIHandler, start_fake
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow the synthetic corpus is random bytes behind a JPEG header
+    Image = None
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+# -------- CORPUS --------
+def load_corpus(path):
+    images = []
+    for name in sorted(os.listdir(path)):
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+            with open(os.path.join(path, name), "rb") as f:
+                images.append(f.read())
+    return images
+
+
+def synthetic_corpus(count=8, size=(2016, 1512), seed=0):
+    """Phone-sized sample images, so preprocessing and upload sizes look realistic."""
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        if Image is None:
+            images.append(b"\xff\xd8\xff\xe0" + rng.randbytes(1_500_000))
+            continue
+        img = Image.effect_noise(size, rng.uniform(20, 80)).convert("RGB")
+        overlay = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+        out = io.BytesIO()
+        Image.blend(img, overlay, 0.5).save(out, format="JPEG", quality=92)
+        images.append(out.getvalue())
+    return images
+
+
+# -------- SERVER UNDER TEST --------
+def start_server(port, env, use_gunicorn):
+    if use_gunicorn:
+        cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "server:app"]
+    else:
+        cmd = [sys.executable, "server.py"]
+    # stderr goes to a temp file, not a pipe: access logs would fill a pipe and stall the server
+    stderr = tempfile.TemporaryFile()
+    proc = subprocess.Popen(cmd, cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=stderr)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            stderr.seek(0)
+            raise RuntimeError(f"Server exited early:\n{stderr.read().decode(errors='replace')}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=1).read()
+            return proc
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("Server did not become ready within 30s")
+
+
+def _children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def _status_kb(pid, field):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def peak_rss_mb(pid):
+    """Peak RSS (VmHWM) summed over the server process tree. Linux only; None elsewhere."""
+    if pid is None or not os.path.exists(f"/proc/{pid}/status"):
+        return None
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += _status_kb(current, "VmHWM")
+        stack.extend(_children(current))
+    return round(total / 1024, 1)
+
+
+# -------- LOAD GENERATION --------
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {
+        "p50": round(percentile(values, 50), 1),
+        "p95": round(percentile(values, 95), 1),
+        "p99": round(percentile(values, 99), 1),
+        "mean": round(sum(values) / len(values), 1),
+        "max": round(values[-1], 1),
+    }
+
+
+def parse_server_timing(header):
+    stages = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        if params.startswith("dur="):
+            stages.setdefault(name, []).append(float(params[4:]))
+    return stages
+
+
+def analyze_request(base_url, image, ingest):
+    if ingest == "json":
+        body = json.dumps({"image": base64.b64encode(image).decode("ascii"), "caption": ""}).encode("utf-8")
+        return urllib.request.Request(
+            f"{base_url}/analyze", data=body, headers={"Content-Type": "application/json"}, method="POST"
+        )
+    return urllib.request.Request(
+        f"{base_url}/analyze", data=image, headers={"Content-Type": "image/jpeg"}, method="POST"
+    )
+
+
+def signature_request(base_url, index):
+    body = json.dumps({
+        "public_id": f"bench_{index}",
+        "folder": "disypher_uploads",
+        "timestamp": str(int(time.time())),
+        "upload_preset": "bench",
+    }).encode("utf-8")
+    return urllib.request.Request(
+        f"{base_url}/cloudinary-signature", data=body, headers={"Content-Type": "application/json"}, method="POST"
+    )
+
+
+def run_level(base_url, scenario, concurrency, total, corpus, ingest, timeout):
+    results = []
+    lock = threading.Lock()
+
+    def one(index):
+        if scenario == "analyze":
+            req = analyze_request(base_url, corpus[index % len(corpus)], ingest)
+        else:
+            req = signature_request(base_url, index)
+
+        started = time.perf_counter()
+        status, timing, error = None, None, None
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as response:
+                response.read()
+                status = response.status
+                timing = response.headers.get("Server-Timing")
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+            timing = e.headers.get("Server-Timing")
+        except Exception as e:
+            error = type(e).__name__
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        with lock:
+            results.append((status, elapsed_ms, timing, error))
+
+    wall_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - wall_started
+
+    status_counts, stage_samples = {}, {}
+    for status, _, timing, error in results:
+        key = str(status) if status is not None else error
+        status_counts[key] = status_counts.get(key, 0) + 1
+        for stage, durations in parse_server_timing(timing).items():
+            stage_samples.setdefault(stage, []).extend(durations)
+
+    ok = [elapsed for status, elapsed, _, _ in results if status == 200]
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": len(ok),
+        "status_counts": status_counts,
+        "wall_seconds": round(wall, 3),
+        "requests_per_second": round(total / wall, 2) if wall else None,
+        "latency_ms": summarize([elapsed for _, elapsed, _, _ in results]),
+        "ok_latency_ms": summarize(ok),
+        "stages_ms": {stage: summarize(values) for stage, values in sorted(stage_samples.items())},
+    }
+
+
+def scrape_counters(base_url, prefixes=("analyze_stage_fallbacks_total", "dish_identifications_total",
+                                        "openai_tokens_total", "admission_rejections_total")):
+    try:
+        text = urllib.request.urlopen(f"{base_url}/metrics", timeout=5).read().decode("utf-8")
+    except Exception:
+        return {}
+    return {
+        name: float(value)
+        for name, _, value in (line.rpartition(" ") for line in text.splitlines())
+        if name.startswith(prefixes)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SERVER_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+# -------- CLI --------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark for the dish analysis server.")
+    parser.add_argument("--scenario", action="append", choices=["analyze", "signature"],
+                        help="Endpoint(s) to drive (default: both)")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=40, help="Requests per scenario and level")
+    parser.add_argument("--images", help="Directory of sample images (default: synthetic phone-sized JPEGs)")
+    parser.add_argument("--ingest", choices=["raw", "json"], default="raw", help="How /analyze receives images")
+    parser.add_argument("--timeout", type=float, default=180, help="Client timeout per request, seconds")
+    parser.add_argument("--identify-latency", default="uniform:0.5,1.5")
+    parser.add_argument("--generate-latency", default="uniform:2,6")
+    parser.add_argument("--upload-latency", default="uniform:0.3,1.2")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of upstream calls answering 500")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of completions with broken JSON")
+    parser.add_argument("--unknown-rate", type=float, default=0.1, help="Share of identifications returning unknown")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warm", action="store_true", help="Keep the dish cache and image index enabled")
+    parser.add_argument("--gunicorn", action="store_true", help="Serve with gunicorn.conf.py instead of server.py")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--target", help="Benchmark an already-running server at this URL instead of starting one")
+    parser.add_argument("--output", help="Where to write the JSON report (default: bench_results/<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    scenarios = args.scenario or ["analyze", "signature"]
+    levels = [int(level) for level in args.concurrency.split(",")]
+    corpus = load_corpus(args.images) if args.images else synthetic_corpus(seed=args.seed)
+    if not corpus:
+        parser.error(f"no images found in {args.images}")
+
+    fake_config = FakeConfig(
+        identify_latency=args.identify_latency,
+        generate_latency=args.generate_latency,
+        upload_latency=args.upload_latency,
+        failure_rate=args.failure_rate,
+        malformed_rate=args.malformed_rate,
+        unknown_rate=args.unknown_rate,
+        seed=args.seed,
+    )
+    openai_server, openai_url = start_fake(FakeOpenAIHandler, fake_config)
+    cloudinary_server, cloudinary_url = start_fake(FakeCloudinaryHandler, fake_config)
+
+    proc = None
+    base_url = args.target
+    if not base_url:
+        env = dict(
+            os.environ,
+            PORT=str(args.port),
+            OPENAI_API_KEY="bench-fake-key",
+            OPENAI_BASE_URL=f"{openai_url}/v1",
+            CLOUDINARY_CLOUD_NAME="bench",
+            CLOUDINARY_API_KEY="bench-key",
+            CLOUDINARY_API_SECRET="bench-secret",
+            CLOUDINARY_UPLOAD_PREFIX=cloudinary_url,
+        )
+        if not args.warm:
+            env.update(DISH_CACHE_PATH="", DISH_CACHE_MAX_ENTRIES="0", IMAGE_INDEX_MAX_ENTRIES="0")
+        proc = start_server(args.port, env, args.gunicorn)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    report = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "corpus": {"images": len(corpus), "mean_bytes": sum(map(len, corpus)) // len(corpus)},
+        "runs": [],
+    }
+
+    try:
+        for scenario in scenarios:
+            for concurrency in levels:
+                print(f"▶️ {scenario} @ concurrency {concurrency} ({args.requests} requests)", flush=True)
+                run = run_level(base_url, scenario, concurrency, args.requests, corpus, args.ingest, args.timeout)
+                run["peak_rss_mb"] = peak_rss_mb(proc.pid if proc else None)
+                report["runs"].append(run)
+                latency = run["latency_ms"] or {}
+                print(
+                    f"   {run['requests_per_second']} req/s  p50={latency.get('p50')}ms  "
+                    f"p95={latency.get('p95')}ms  p99={latency.get('p99')}ms  "
+                    f"status={run['status_counts']}  peak_rss={run['peak_rss_mb']}MB",
+                    flush=True,
+                )
+        report["server_counters"] = scrape_counters(base_url)
+        report["upstream_calls"] = dict(fake_config.stats)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        openai_server.shutdown()
+        cloudinary_server.shutdown()
+
+    output = args.output or os.path.join(SERVER_DIR, "bench_results", time.strftime("%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"📄 Wrote {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
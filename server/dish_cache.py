@@ -0,0 +1,198 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from telemetry import log
+
+
+def normalize_dish_name(dish_name):
+    """'  Chicken   Alfredo! ' -> 'chicken alfredo'"""
+    cleaned = re.sub(r"[^\w\s]", " ", dish_name.lower())
+    return re.sub(r"\s+", " ", cleaned).strip()
+
+
+def make_cache_key(dish_name, user_caption=""):
+    key = normalize_dish_name(dish_name)
+    caption = re.sub(r"\s+", " ", (user_caption or "").strip().lower())
+    # The caption only feeds the description prompt, but it still changes the output
+    if caption:
+        key += f"|{caption}"
+    return key
+
+
+class DishCache:
+    """In-memory LRU + TTL cache for generated dish details, backed by SQLite.
+
+    Values are plain JSON-serializable objects. Memory holds the hot set; SQLite keeps
+    everything within the TTL so a restart doesn't throw away paid-for generations.
+    `get_or_compute` also coalesces concurrent misses for the same key into a single
+    call to `compute`; `claim` exposes the same single-flight map to callers that
+    produce the value incrementally (e.g. a streamed response).
+    """
+
+    def __init__(self, path=None, max_entries=512, ttl_seconds=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.RLock()
+        self._in_flight = {}  # key -> Future
+        self._db = None
+        self._db_lock = threading.Lock()
+
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS dish_cache ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+                )
+                self._db.execute("DELETE FROM dish_cache WHERE stored_at < ?", (time.time() - ttl_seconds,))
+                self._db.commit()
+            except sqlite3.Error as e:
+                log("⚠️ Dish cache store unavailable. Running memory-only.", path=path, error=str(e))
+                self._db = None
+
+    # -------- memory layer --------
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.time() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _memory_put(self, key, value, stored_at):
+        with self._lock:
+            self._entries[key] = (stored_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # -------- disk layer --------
+    def _disk_get(self, key):
+        if self._db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT value, stored_at FROM dish_cache WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            log("🔥 Error reading dish cache", error=str(e))
+            return None
+        if row is None:
+            return None
+        value, stored_at = row
+        if time.time() - stored_at > self.ttl_seconds:
+            return None
+        return json.loads(value), stored_at
+
+    def _disk_put(self, key, value, stored_at):
+        if self._db is None:
+            return
+        try:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO dish_cache (key, value, stored_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), stored_at),
+                )
+                self._db.commit()
+        except sqlite3.Error as e:
+            log("🔥 Error writing dish cache", error=str(e))
+
+    # -------- public API --------
+    def get(self, key):
+        value = self._memory_get(key)
+        if value is not None:
+            return value
+        found = self._disk_get(key)
+        if found is None:
+            return None
+        value, stored_at = found
+        self._memory_put(key, value, stored_at)
+        return value
+
+    def put(self, key, value):
+        stored_at = time.time()
+        self._memory_put(key, value, stored_at)
+        self._disk_put(key, value, stored_at)
+
+    def claim(self, key):
+        """Single-flight entry point for callers that can't hand over a `compute` callable.
+
+        Returns (status, value_or_future):
+          ("HIT", value)           cached
+          ("COALESCED", future)    someone else is generating it; wait on the future
+          ("MISS", future)         the caller now owns the generation and must finish it
+                                   with `resolve` or `reject`
+        """
+        value = self.get(key)
+        if value is not None:
+            return "HIT", value
+
+        with self._lock:
+            # Re-check under the lock: an owner may have finished since the lookup above
+            value = self._memory_get(key)
+            if value is not None:
+                return "HIT", value
+            future = self._in_flight.get(key)
+            if future is not None:
+                return "COALESCED", future
+            future = self._in_flight[key] = Future()
+            return "MISS", future
+
+    def resolve(self, key, value, store=True):
+        """Hand the owner's result to everyone waiting on `key` (and cache it if `store`)."""
+        try:
+            if store:
+                self.put(key, value)
+        finally:
+            # Waiters get the value even if caching it failed
+            with self._lock:
+                future = self._in_flight.pop(key)
+            future.set_result(value)
+
+    def reject(self, key, error):
+        with self._lock:
+            future = self._in_flight.pop(key)
+        future.set_exception(error)
+
+    def get_or_compute(self, key, compute, should_store=lambda value: True):
+        """Return (value, status) where status is "HIT", "MISS" or "COALESCED".
+
+        Only the caller that starts the generation runs `compute`; anyone asking for
+        the same key meanwhile waits on its result. Values rejected by
+        `should_store` (e.g. fallbacks) are handed back but never cached.
+        """
+        status, found = self.claim(key)
+        if status == "HIT":
+            return found, status
+        if status == "COALESCED":
+            return found.result(), status
+
+        try:
+            value = compute()
+        except Exception as e:
+            self.reject(key, e)
+            raise
+        self.resolve(key, value, store=should_store(value))
+        return value, status
+
+
+def cache_from_env():
+    path = os.getenv("DISH_CACHE_PATH", "dish_cache.sqlite3")
+    return DishCache(
+        path=path or None,
+        max_entries=int(os.getenv("DISH_CACHE_MAX_ENTRIES", "512")),
+        ttl_seconds=int(os.getenv("DISH_CACHE_TTL", str(7 * 24 * 3600))),
+    )
@@ -0,0 +1,31 @@
+# Production serving: run from server/ with
+#   gunicorn -c gunicorn.conf.py server:app
+#
+# gthread workers fit this app: every analysis is a long, I/O-bound request that
+# spends its time waiting on OpenAI and Cloudinary, and the pipeline already fans out
+# on its own thread pools. Admission control lives in the app (see admission.py), so
+# the thread count just has to cover every admitted + queued analysis plus headroom
+# for /cloudinary-signature and fast 429/503 rejections.
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+worker_class = "gthread"
+
+# Caches, the image index and admission counters are per process; keep one worker
+# unless you need more CPU for image preprocessing.
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+threads = (
+    int(os.getenv("MAX_IN_FLIGHT_ANALYSES", "8"))
+    + int(os.getenv("MAX_QUEUED_ANALYSES", "16"))
+    + int(os.getenv("EXTRA_THREADS", "8"))
+)
+
+# Never preload: the app creates thread pools at import time, which must not be forked.
+preload_app = False
+
+# Long analyses are normal; the worker heartbeat doesn't depend on request length with
+# gthread, but keep this generous anyway.
+timeout = 300
+# SIGTERM: stop accepting, let in-flight analyses (including streams) finish.
+graceful_timeout = int(os.getenv("DRAIN_TIMEOUT", "180"))
+keepalive = 5
@@ -0,0 +1,154 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from telemetry import log
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional: without it we only dedupe exact byte matches
+    Image = None
+
+
+def dhash(image_bytes, hash_size=8):
+    """64-bit difference hash, or None when the image can't be decoded."""
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img.draft("L", (hash_size * 16, hash_size * 16))  # Cheap JPEG downscale on decode
+            small = img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+            pixels = small.tobytes()  # One byte per pixel in "L" mode
+    except Exception as e:
+        log("⚠️ Could not compute perceptual hash", error=str(e))
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+class ImageFingerprint:
+    def __init__(self, image_bytes):
+        self.sha256 = hashlib.sha256(image_bytes).hexdigest()
+        self.dhash = dhash(image_bytes)
+
+
+class ImageIndex:
+    """Bounded LRU index from image fingerprints to a previous analysis verdict.
+
+    Each entry maps an exact SHA-256 and a dHash to the `imageUrl` and title we
+    returned for it, so a re-submitted (or nearly identical) photo skips both the
+    Cloudinary upload and the vision call. "Unknown Dish" verdicts are kept too, so
+    known non-food images are rejected immediately. The caption is part of the match
+    because it feeds the identification prompt. `claim` also coalesces identical
+    photos that arrive together (a double tap), so only the first one is uploaded and
+    identified while the others wait for its verdict.
+    """
+
+    def __init__(self, max_entries=2048, max_distance=4, unknown_max_distance=6):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.unknown_max_distance = unknown_max_distance
+        self._entries = OrderedDict()  # sha256 -> entry dict
+        self._lock = threading.Lock()
+        self._in_flight = {}  # (sha256, caption) -> Future
+
+    def _lookup(self, fingerprint, user_caption):
+        entry = self._entries.get(fingerprint.sha256)
+        if entry is not None and entry["caption"] == user_caption:
+            self._entries.move_to_end(fingerprint.sha256)
+            return dict(entry, match="exact")
+
+        if fingerprint.dhash is None:
+            return None
+
+        best_key, best_distance = None, None
+        for key, candidate in self._entries.items():
+            if candidate["dhash"] is None or candidate["caption"] != user_caption:
+                continue
+            distance = (candidate["dhash"] ^ fingerprint.dhash).bit_count()
+            limit = self.unknown_max_distance if candidate["unknown"] else self.max_distance
+            if distance <= limit and (best_distance is None or distance < best_distance):
+                best_key, best_distance = key, distance
+                if distance == 0:
+                    break
+
+        if best_key is None:
+            return None
+        self._entries.move_to_end(best_key)
+        return dict(self._entries[best_key], match="perceptual", distance=best_distance)
+
+    def lookup(self, fingerprint, user_caption=""):
+        """Return the stored entry ({image_url, title, ...}) or None."""
+        with self._lock:
+            return self._lookup(fingerprint, user_caption)
+
+    def claim(self, fingerprint, user_caption=""):
+        """Like `lookup`, but also coalesces identical images already being analyzed.
+
+        Returns (status, entry_or_future):
+          ("HIT", entry)           seen before
+          ("COALESCED", future)    the same bytes are in flight; the future yields an entry
+          ("MISS", future)         the caller owns this image and must finish it with
+                                   `resolve` or `reject`
+        """
+        key = (fingerprint.sha256, user_caption)
+        with self._lock:
+            entry = self._lookup(fingerprint, user_caption)
+            if entry is not None:
+                return "HIT", entry
+            future = self._in_flight.get(key)
+            if future is not None:
+                return "COALESCED", future
+            future = self._in_flight[key] = Future()
+            return "MISS", future
+
+    def resolve(self, fingerprint, image_url, title, user_caption="", unknown=False, store=True):
+        """Hand the owner's verdict to identical images waiting on it (and `record` it if `store`)."""
+        try:
+            if store:
+                self.record(fingerprint, image_url, title, user_caption, unknown)
+        finally:
+            with self._lock:
+                future = self._in_flight.pop((fingerprint.sha256, user_caption))
+            future.set_result({
+                "dhash": fingerprint.dhash,
+                "image_url": image_url,
+                "title": title,
+                "caption": user_caption,
+                "unknown": unknown,
+                "match": "in_flight",
+            })
+
+    def reject(self, fingerprint, error, user_caption=""):
+        with self._lock:
+            future = self._in_flight.pop((fingerprint.sha256, user_caption))
+        future.set_exception(error)
+
+    def record(self, fingerprint, image_url, title, user_caption="", unknown=False):
+        with self._lock:
+            self._entries[fingerprint.sha256] = {
+                "dhash": fingerprint.dhash,
+                "image_url": image_url,
+                "title": title,
+                "caption": user_caption,
+                "unknown": unknown,
+            }
+            self._entries.move_to_end(fingerprint.sha256)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def index_from_env():
+    return ImageIndex(
+        max_entries=int(os.getenv("IMAGE_INDEX_MAX_ENTRIES", "2048")),
+        max_distance=int(os.getenv("IMAGE_DEDUPE_MAX_DISTANCE", "4")),
+        unknown_max_distance=int(os.getenv("IMAGE_DEDUPE_UNKNOWN_MAX_DISTANCE", "6")),
+    )
@@ -0,0 +1,79 @@
+import io
+import os
+
+from telemetry import log
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional: without it images go out exactly as received
+    Image = None
+    ImageOps = None
+
+
+class PreparedImage:
+    def __init__(self, data, original_size, width=None, height=None, reencoded=False):
+        self.data = data
+        self.original_size = original_size
+        self.width = width
+        self.height = height
+        self.reencoded = reencoded
+
+    @property
+    def bytes_saved(self):
+        return self.original_size - len(self.data)
+
+
+class ImagePreprocessor:
+    """Normalize phone photos before anything leaves the server.
+
+    Applies EXIF orientation, downscales so the longest edge is at most `max_edge`,
+    and re-encodes to JPEG or WebP at `quality`. Re-encoding drops EXIF/GPS metadata
+    as a side effect. Small, metadata-free images that don't shrink on re-encode are
+    passed through untouched.
+    """
+
+    def __init__(self, max_edge=1536, quality=85, image_format="JPEG"):
+        self.max_edge = max_edge
+        self.quality = quality
+        self.image_format = image_format.upper()
+
+    def prepare(self, image_bytes):
+        if Image is None:
+            return PreparedImage(image_bytes, len(image_bytes))
+
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as img:
+                original_dims = img.size
+                has_metadata = bool(img.getexif())
+                # Let the JPEG decoder do most of the downscaling for free
+                img.draft("RGB", (self.max_edge, self.max_edge))
+                img = ImageOps.exif_transpose(img)
+                if img.mode not in ("RGB", "L"):
+                    img = img.convert("RGB")
+                img.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+
+                out = io.BytesIO()
+                save_kwargs = {"quality": self.quality}
+                if self.image_format == "JPEG":
+                    save_kwargs.update(optimize=True, progressive=True)
+                else:
+                    save_kwargs["method"] = 4
+                img.save(out, format=self.image_format, **save_kwargs)
+                width, height = img.size
+        except Exception as e:
+            log("⚠️ Image preprocessing failed, using original bytes", error=str(e))
+            return PreparedImage(image_bytes, len(image_bytes))
+
+        data = out.getvalue()
+        untouched = (width, height) == original_dims and not has_metadata
+        if untouched and len(data) >= len(image_bytes):
+            return PreparedImage(image_bytes, len(image_bytes), width, height)
+        return PreparedImage(data, len(image_bytes), width, height, reencoded=True)
+
+
+def preprocessor_from_env():
+    return ImagePreprocessor(
+        max_edge=int(os.getenv("IMAGE_MAX_EDGE", "1536")),
+        quality=int(os.getenv("IMAGE_QUALITY", "85")),
+        image_format=os.getenv("IMAGE_FORMAT", "JPEG"),
+    )
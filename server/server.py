@@ -1,20 +1,45 @@
 import os
+import contextvars
+import functools
+import signal
 import base64
+import io
 import re
 import json
+import queue
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request, jsonify, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
 import openai
 import cloudinary
 import cloudinary.uploader
+import threading
 import time
 import hmac
 import hashlib
 import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed, wait
+from dish_cache import cache_from_env, make_cache_key
+from image_index import ImageFingerprint, index_from_env
+from image_prep import preprocessor_from_env
+from admission import AdmissionRejected, admission_from_env
+from contextlib import contextmanager
+from telemetry import REGISTRY, Counter, GaugeFunc, Histogram, RequestTrace, current_trace, log, submit_in_context
 
 load_dotenv(dotenv_path="secrets.env")
 
+
+class InMemoryRequest(Request):
+    """Keep multipart file parts in memory instead of spooling them to temp files."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
+
 app = Flask(__name__)
+app.request_class = InMemoryRequest
+# Phone photos are a few MB; anything far beyond that is rejected with a 413 before we buffer it
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_UPLOAD_BYTES", str(15 * 1024 * 1024)))
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 CLOUDINARY_CLOUD_NAME = os.getenv("CLOUDINARY_CLOUD_NAME")
@@ -27,212 +52,1117 @@ cloudinary.config(
     api_key=CLOUDINARY_API_KEY,
     api_secret=CLOUDINARY_API_SECRET,
 )
+# Only set for local stand-ins (see benchmark.py); OpenAI's equivalent is OPENAI_BASE_URL
+if os.getenv("CLOUDINARY_UPLOAD_PREFIX"):
+    cloudinary.config(upload_prefix=os.getenv("CLOUDINARY_UPLOAD_PREFIX"))
 
-@app.route("/analyze", methods=["POST"])
-def analyze():
+# -------- METRICS --------
+# Exposed in Prometheus text format on GET /metrics. Stage names: decode, fingerprint,
+# preprocess, upload, identify, description, healthy_recipe, mimic_recipe.
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "analyze_stage_seconds", "Time spent in each /analyze pipeline stage.", ("stage", "outcome"),
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120),
+))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "analyze_stage_errors_total", "Exceptions raised inside a pipeline stage.", ("stage",)
+))
+STAGE_FALLBACKS = REGISTRY.register(Counter(
+    "analyze_stage_fallbacks_total", "Times a stage returned its placeholder instead of a real result.",
+    ("stage", "outcome"),
+))
+OPENAI_TOKENS = REGISTRY.register(Counter(
+    "openai_tokens_total", "OpenAI tokens used, from completion usage.", ("stage", "kind")
+))
+OPENAI_COST = REGISTRY.register(Counter(
+    "openai_cost_usd_total", "Estimated OpenAI spend in USD.", ("stage",)
+))
+IDENTIFICATIONS = REGISTRY.register(Counter(
+    "dish_identifications_total", "Dish identification verdicts.", ("verdict", "source")
+))
+DISH_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "dish_cache_lookups_total", "Dish detail cache lookups by result.", ("status",)
+))
+PREPROCESS_BYTES_SAVED = REGISTRY.register(Counter(
+    "image_preprocess_bytes_saved_total", "Bytes removed by image preprocessing before upload and vision."
+))
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "HTTP requests by route and status.", ("route", "status")
+))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    "http_request_seconds", "End-to-end request time, including streamed bodies.", ("route",),
+    buckets=(0.05, 0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 90, 120, 300),
+))
+
+# USD per 1M tokens (input, output). Override when pricing changes.
+MODEL_PRICING = {
+    "gpt-4o": (
+        float(os.getenv("GPT4O_INPUT_COST_PER_M", "2.50")),
+        float(os.getenv("GPT4O_OUTPUT_COST_PER_M", "10.00")),
+    ),
+}
+
+
+@contextmanager
+def stage_timer(stage):
+    """Time a pipeline stage into STAGE_SECONDS and the request's Server-Timing."""
+    started = time.perf_counter()
+    outcome = "ok"
     try:
-        data = request.get_json(force=True)
-        image_b64 = data.get("image")
-        user_caption = data.get("caption", "").strip()
+        yield
+    except Exception:
+        outcome = "error"
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage, outcome=outcome)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_timing(stage, elapsed)
 
-        if not image_b64:
-            return jsonify({"error": "No image provided"}), 400
 
-        # Decode image
-        try:
-            image_bytes = base64.b64decode(image_b64)
-        except Exception:
-            return jsonify({"error": "Invalid base64 image"}), 400
+def stage_failed(stage, error, outcome="error"):
+    """Count and log a stage falling back. Call it only where the placeholder is returned."""
+    STAGE_FALLBACKS.inc(stage=stage, outcome=outcome)
+    log(f"🔥 Error during {stage}, using fallback", stage=stage, outcome=outcome, error=str(error))
+
+
+def record_usage(stage, model, usage):
+    if usage is None:
+        return
+    prompt_tokens = usage.prompt_tokens or 0
+    completion_tokens = usage.completion_tokens or 0
+    OPENAI_TOKENS.inc(prompt_tokens, stage=stage, kind="prompt")
+    OPENAI_TOKENS.inc(completion_tokens, stage=stage, kind="completion")
+
+    input_price, output_price = MODEL_PRICING.get(model, (0.0, 0.0))
+    cost = (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+    OPENAI_COST.inc(cost, stage=stage)
+    log("🧾 OpenAI usage", stage=stage, model=model, prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens, cost_usd=round(cost, 6))
+
+
+# -------- UPSTREAM CONCURRENCY LIMITS --------
+# Shared by every request (single, streaming and batch) so a big batch can't flood
+# OpenAI or Cloudinary with more parallel calls than our rate limits allow.
+OPENAI_LIMIT = threading.BoundedSemaphore(int(os.getenv("OPENAI_MAX_CONCURRENCY", "16")))
+CLOUDINARY_LIMIT = threading.BoundedSemaphore(int(os.getenv("CLOUDINARY_MAX_CONCURRENCY", "8")))
+
+
+def chat_completion(stage, **kwargs):
+    with OPENAI_LIMIT:
+        mark_stage_started()
+        response = openai.chat.completions.create(**kwargs)
+    record_usage(stage, kwargs.get("model"), getattr(response, "usage", None))
+    return response
+
+
+# -------- GENERATION STAGES --------
+# Description, healthy recipe and mimic recipe only depend on the dish name, so they
+# fan out on a shared pool. The pool is module-level (not a per-request `with` block)
+# so a stage that blows its deadline never holds the response hostage.
+DESCRIPTION_TIMEOUT = 30
+RECIPE_TIMEOUT = 60
+STAGE_GRACE = 5  # Extra seconds on top of the OpenAI timeout before we give up on a stage
+
+# Admission control (see ADMISSION CONTROL below) bounds how many analyses run at once,
+# so the pool is sized for every one of them to run all three stages without queueing.
+# Batch items generate on their own pool (see BATCH ANALYZE).
+ADMISSION = admission_from_env()
+GENERATION_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("GENERATION_WORKERS", str(3 * ADMISSION.max_in_flight))),
+    thread_name_prefix="dish-gen",
+)
+
+# The StageTask of the generation stage running on this thread, if any
+current_stage = contextvars.ContextVar("current_stage", default=None)
+
+
+class StageTask:
+    """A generation stage submitted to a pool, plus when its OpenAI call actually started.
+
+    A stage's deadline runs from that moment, not from submission: time spent queued
+    for a pool thread or an OpenAI permit makes a busy server slower instead of turning
+    a call we're about to pay for into a fallback.
+    """
+
+    def __init__(self, pool, fn, *args):
+        self.started_at = None
+        self._started = threading.Event()
+        self.future = submit_in_context(pool, self._run, fn, *args)
+        # A stage that never reached its call (failed early, cancelled) is "started" when done
+        self.future.add_done_callback(lambda _: self.mark_started())
+
+    def _run(self, fn, *args):
+        current_stage.set(self)
+        return fn(*args)
+
+    def mark_started(self):
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+        self._started.set()
+
+    def wait_started(self, timeout=None):
+        self._started.wait(timeout)
+        return self.started_at
+
+
+def mark_stage_started():
+    task = current_stage.get()
+    if task is not None:
+        task.mark_started()
+
+RECIPE_JSON_FORMAT = (
+    "{"
+    "\"title\": \"string\", "
+    "\"ingredients\": [\"string\"], "
+    "\"instructions\": [\"string\"], "
+    "\"servings\": int, "
+    "\"prepTime\": \"string\", "
+    "\"cookTime\": \"string\", "
+    "\"nutrition\": {\"calories\": int, \"protein\": \"string\", \"carbs\": \"string\", \"fat\": \"string\"}"
+    "}"
+)
+
+DESCRIPTION_FALLBACK = "No description available."
+
+
+def empty_recipe(title):
+    return {
+        "title": title,
+        "ingredients": [],
+        "instructions": [],
+        "servings": 0,
+        "prepTime": "",
+        "cookTime": "",
+        "nutrition": {}
+    }
+
+
+def nonempty_description(content):
+    """Raise on an empty description so /analyze and /analyze/stream both fall back the same way."""
+    description = (content or "").strip()
+    if not description:
+        raise ValueError("GPT returned an empty description")
+    return description
+
+
+def description_messages(dish_name, user_caption=""):
+    prompt = f"Describe the dish '{dish_name}' in two clean and precise yet descriptive sentences."
+    if user_caption:
+        prompt += f" User also described it as: \"{user_caption}\""
+
+    return [
+        {"role": "system", "content": (
+            "You are a culinary expert. Write an accurate description describing the dish you see in the image."
+            "Mention ingredients, flavors, and textures."
+        )},
+        {"role": "user", "content": prompt}
+    ]
+
+
+# The generate_* stages raise on failure; await_stage turns that into the fallback, so a
+# stage that already timed out doesn't count its late failure as a second fallback.
+def generate_description(dish_name, user_caption=""):
+    with stage_timer("description"):
+        desc_response = chat_completion(
+            "description",
+            model="gpt-4o",
+            messages=description_messages(dish_name, user_caption),
+            max_tokens=300,
+            timeout=DESCRIPTION_TIMEOUT
+        )
+        return nonempty_description(desc_response.choices[0].message.content)
+
+
+def stream_description(dish_name, user_caption=""):
+    """Yield description text deltas as GPT produces them. Raises on API errors."""
+    with OPENAI_LIMIT:
+        mark_stage_started()
+        stream = openai.chat.completions.create(
+            model="gpt-4o",
+            messages=description_messages(dish_name, user_caption),
+            max_tokens=300,
+            timeout=DESCRIPTION_TIMEOUT,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        for chunk in stream:
+            # With include_usage the last chunk carries usage and no choices
+            if getattr(chunk, "usage", None) is not None:
+                record_usage("description", "gpt-4o", chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+def generate_streamed_description(deltas, dish_name, user_caption=""):
+    """Description stage for /analyze/stream: puts each delta on `deltas`, then None.
+
+    Runs on the generation pool, so the OpenAI permit is released as soon as GPT is done,
+    however slowly the HTTP client reads the relayed deltas.
+    """
+    parts = []
+    try:
+        with stage_timer("description"):
+            for delta in stream_description(dish_name, user_caption):
+                parts.append(delta)
+                deltas.put(delta)
+    finally:
+        deltas.put(None)
+    return nonempty_description("".join(parts))
+
+
+def generate_healthy_recipe(dish_name):
+    with stage_timer("healthy_recipe"):
+        healthy_response = chat_completion(
+            "healthy_recipe",
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": (
+                    "You are a professional chef and nutritionist. Generate a structured JSON for a healthier version of the given dish. "
+                    "JSON format only. No markdown or explanations. Format:\n" + RECIPE_JSON_FORMAT
+                )},
+                {"role": "user", "content": f"Give a healthier recipe for the '{dish_name}' using that JSON structure."}
+            ],
+            max_tokens=1000,
+            timeout=RECIPE_TIMEOUT
+        )
+        return json.loads(healthy_response.choices[0].message.content.strip())
+
+
+def generate_mimic_recipe(dish_name):
+    with stage_timer("mimic_recipe"):
+        mimic_response = chat_completion(
+            "mimic_recipe",
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": (
+                    "You are a professional chef. Generate a structured JSON recipe that closely mimics the original dish. "
+                    "JSON format only. No markdown or hashtags. Format:\n" + RECIPE_JSON_FORMAT
+                )},
+                {"role": "user", "content": f"Create a mimic recipe for the '{dish_name}' using that JSON structure."}
+            ],
+            max_tokens=1000,
+            timeout=RECIPE_TIMEOUT
+        )
+        return json.loads(mimic_response.choices[0].message.content.strip())
+
+
+def await_stage(task, stage, timeout, fallback):
+    """Wait for a stage until its own deadline, falling back instead of raising."""
+    started = task.wait_started()
+    remaining = max(0.0, started + timeout + STAGE_GRACE - time.monotonic())
+    try:
+        return task.future.result(timeout=remaining)
+    except FutureTimeoutError:
+        task.future.cancel()
+        stage_failed(stage, f"timed out after {timeout + STAGE_GRACE}s", outcome="timeout")
+    except Exception as e:
+        stage_failed(stage, e)
+    return fallback
+
 
-        # Save image to temp file
-        temp_filename = "temp.jpg"
-        with open(temp_filename, "wb") as f:
-            f.write(image_bytes)
+def stages_in_completion_order(tasks, timeout):
+    """Yield StageTasks as they finish or run out of time (await_stage then falls back)."""
+    pending = set(tasks)
+    while pending:
+        now = time.monotonic()
+        deadlines = [task.started_at + timeout + STAGE_GRACE for task in pending if task.started_at is not None]
+        # Stages still queued have no deadline yet, so check back on them periodically
+        wait_for = min([max(0.0, d - now) for d in deadlines] + [1.0])
+        wait([task.future for task in pending], timeout=wait_for, return_when=FIRST_COMPLETED)
 
-        # Upload to Cloudinary
-        unique_id = f"dish_{uuid.uuid4().hex[:10]}"
+        now = time.monotonic()
+        ready = {
+            task for task in pending
+            if task.future.done() or (task.started_at is not None and now >= task.started_at + timeout + STAGE_GRACE)
+        }
+        pending -= ready
+        yield from ready
 
+
+def generate_dish_details(dish_name, user_caption="", pool=GENERATION_POOL):
+    """Run description, healthy recipe and mimic recipe concurrently on `pool`.
+
+    Wall time is bounded by the slowest stage, and each stage degrades to its own
+    fallback independently of the others.
+    """
+    desc_task = StageTask(pool, generate_description, dish_name, user_caption)
+    healthy_task = StageTask(pool, generate_healthy_recipe, dish_name)
+    mimic_task = StageTask(pool, generate_mimic_recipe, dish_name)
+
+    description = await_stage(desc_task, "description", DESCRIPTION_TIMEOUT, DESCRIPTION_FALLBACK)
+    healthy_recipe = await_stage(healthy_task, "healthy_recipe", RECIPE_TIMEOUT, empty_recipe("Healthy Version"))
+    mimic_recipe = await_stage(mimic_task, "mimic_recipe", RECIPE_TIMEOUT, empty_recipe("Mimic Version"))
+    return description, healthy_recipe, mimic_recipe
+
+
+# -------- DISH CACHE --------
+# Everything after identification depends only on the dish name (+ caption), so popular
+# dishes are served from cache instead of paying for three GPT-4o calls again.
+DISH_CACHE = cache_from_env()
+
+
+def is_complete_details(details):
+    """Fallback placeholders must never be cached, or a transient failure sticks for the TTL."""
+    return (
+        details["description"] != DESCRIPTION_FALLBACK
+        and details["healthyRecipe"] != empty_recipe("Healthy Version")
+        and details["mimicRecipe"] != empty_recipe("Mimic Version")
+    )
+
+
+def get_dish_details(dish_name, user_caption="", pool=GENERATION_POOL):
+    """Return ({description, healthyRecipe, mimicRecipe}, cache_status)."""
+    def compute():
+        description, healthy_recipe, mimic_recipe = generate_dish_details(dish_name, user_caption, pool)
+        return {
+            "description": description,
+            "healthyRecipe": healthy_recipe,
+            "mimicRecipe": mimic_recipe,
+        }
+
+    return DISH_CACHE.get_or_compute(
+        make_cache_key(dish_name, user_caption), compute, should_store=is_complete_details
+    )
+
+# -------- IMAGE DEDUPE --------
+# Retries after the "unknown dish" popup and double taps re-send the same photo; the
+# fingerprint index lets those skip the upload and the vision call entirely.
+IMAGE_INDEX = index_from_env()
+
+UNKNOWN_DISH = "Unknown Dish"
+
+# -------- PREPROCESSING --------
+# Full-resolution phone photos are shrunk and re-encoded before the upload and the vision
+# call. VISION_DETAIL ("auto", "low" or "high") trades vision input tokens for detail.
+IMAGE_PREPROCESSOR = preprocessor_from_env()
+VISION_DETAIL = os.getenv("VISION_DETAIL", "auto")
+
+# -------- UPLOAD --------
+# Uploads run on their own pool so identification can start from the inline image while
+# Cloudinary is still receiving it.
+UPLOAD_FOLDER = "disypher_uploads"  # You can name the folder anything
+
+UPLOAD_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("UPLOAD_WORKERS", "8")),
+    thread_name_prefix="upload",
+)
+
+
+def upload_image(image_bytes, public_id):
+    """Upload to Cloudinary straight from memory and return the delivery URL. Raises on failure."""
+    with stage_timer("upload"), CLOUDINARY_LIMIT:
+        upload_result = cloudinary.uploader.upload(
+            io.BytesIO(image_bytes),
+            folder=UPLOAD_FOLDER,
+            public_id=public_id,
+            use_filename=True,
+            overwrite=False
+        )
+    secure_url = upload_result.get("secure_url")
+    return secure_url + "?f_auto,q_auto" if secure_url else None
+
+
+def discard_upload(upload_future, public_id):
+    """Don't keep (or pay for) uploads of images we're not going to return.
+
+    Cancels the upload if it hasn't started yet, otherwise deletes the asset as soon
+    as the upload lands.
+    """
+    if upload_future.cancel():
+        log("🗑️ Skipped upload for unidentified image.", public_id=public_id)
+        return
+
+    def cleanup(future):
+        if future.exception() is not None:
+            return
         try:
-            upload_result = cloudinary.uploader.upload(
-                temp_filename,
-                folder="disypher_uploads",  # You can name the folder anything
-                public_id=unique_id,
-                use_filename=True,
-                overwrite=False
-            )
-            image_url = upload_result.get("secure_url") + "?f_auto,q_auto"
+            with CLOUDINARY_LIMIT:
+                cloudinary.uploader.destroy(f"{UPLOAD_FOLDER}/{public_id}", invalidate=True)
+            log("🗑️ Deleted upload for unidentified image.", public_id=public_id)
         except Exception as e:
-            return jsonify({"error": "Cloudinary upload failed", "details": str(e)}), 500
-        finally:
-            if os.path.exists(temp_filename):
-                os.remove(temp_filename)
+            log("🔥 Error deleting upload", public_id=public_id, error=str(e))
+
+    upload_future.add_done_callback(cleanup)
+
+
+def image_data_url(image_bytes):
+    """Inline the image for the vision call so it doesn't have to wait on the upload."""
+    if image_bytes.startswith(b"\x89PNG"):
+        mime_type = "image/png"
+    elif image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        mime_type = "image/webp"
+    elif image_bytes.startswith(b"GIF8"):
+        mime_type = "image/gif"
+    else:
+        mime_type = "image/jpeg"
+    return f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('ascii')}"
+
+
+def identify_dish(image_url, user_caption=""):
+    """Ask GPT-4o vision for the dish name (`image_url` may be a data URL).
+
+    Returns UNKNOWN_DISH if it can't tell; raises on API errors.
+    """
+    system_prompt = (
+        "You are a culinary expert. Return ONLY a JSON object like: "
+        "{\"title\": \"Chicken Alfredo\"}. No explanation. No markdown. Just clean JSON."
+    )
+
+    user_message = [
+        {"type": "text", "text": "What is the name of this dish? If not a food fish return the unknown JSON. Return only JSON."},
+        {"type": "image_url", "image_url": {"url": image_url, "detail": VISION_DETAIL}},
+    ]
+    if user_caption:
+        user_message.insert(0, {"type": "text", "text": f"User also says: {user_caption}"})
+
+    name_response = chat_completion(
+        "identify",
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message}
+        ],
+        max_tokens=100,
+        timeout=30
+    )
+
+    raw_json = name_response.choices[0].message.content.strip()
+    log("Raw GPT JSON response", stage="identify", raw=raw_json)
+
+    try:
+        parsed = json.loads(raw_json)
+        dish_name = parsed.get("title") or parsed.get("dish_name") or ""
+    except json.JSONDecodeError:
+        dish_name = ""
+
+    # Validate the dish name
+    if (
+        not dish_name
+        or not isinstance(dish_name, str)
+        or dish_name.strip().lower() in {"dish", "food", "unknown", "none"}
+        or not re.search(r"[A-Za-z]{3,}", dish_name)
+    ):
+        return UNKNOWN_DISH
+    return dish_name.strip()
+
+
+class AnalyzeError(Exception):
+    """An error that maps straight onto an HTTP response for /analyze."""
+
+    def __init__(self, payload, status):
+        super().__init__(payload.get("error"))
+        self.payload = payload
+        self.status = status
+
+
+def read_analyze_request():
+    """Return (image_bytes, user_caption) from the current request.
+
+    Accepts, in order of preference:
+      * a raw image body (`Content-Type: image/*` or `application/octet-stream`),
+        with the caption in the `caption` query parameter;
+      * `multipart/form-data` with an `image` file part and an optional `caption` field;
+      * the original JSON body `{"image": "<base64>", "caption": "..."}`.
+    """
+    content_type = request.mimetype or ""
+
+    try:
+        if content_type.startswith("image/") or content_type == "application/octet-stream":
+            return read_image_body(request.get_data(cache=False), request.args.get("caption", ""))
+        if content_type == "multipart/form-data":
+            upload = request.files.get("image")
+            return read_image_body(upload.stream.getvalue() if upload else b"", request.form.get("caption", ""))
+        data = request.get_json(force=True)
+    except RequestEntityTooLarge:
+        raise AnalyzeError(upload_too_large_payload(), 413)
+
+    image_b64 = data.get("image")
+    user_caption = data.get("caption", "").strip()
+
+    if not image_b64:
+        raise AnalyzeError({"error": "No image provided"}, 400)
+
+    # Decode image
+    try:
+        image_bytes = base64.b64decode(image_b64)
+    except Exception:
+        raise AnalyzeError({"error": "Invalid base64 image"}, 400)
+
+    return image_bytes, user_caption
+
+
+def read_image_body(image_bytes, user_caption):
+    if not image_bytes:
+        raise AnalyzeError({"error": "No image provided"}, 400)
+    return image_bytes, user_caption.strip()
+
+
+def upload_too_large_payload():
+    limit = app.config["MAX_CONTENT_LENGTH"]
+    return {"error": f"Image too large. Max upload size is {limit // (1024 * 1024)} MB."}
+
+
+def resolve_dish(image_bytes, user_caption=""):
+    """Dedupe, upload and identify. Returns (image_url, dish_name).
+
+    image_url is None when the dish is unknown, since that upload gets discarded.
+    """
+    # -------- DEDUPE: seen this (or a near-identical) photo before, or is it in flight? --------
+    with stage_timer("fingerprint"):
+        fingerprint = ImageFingerprint(image_bytes)
+        status, previous = IMAGE_INDEX.claim(fingerprint, user_caption)
+
+    if status == "COALESCED":
+        previous = previous.result()  # Raises the first request's AnalyzeError, if it failed
+    if status != "MISS":
+        log("♻️ Duplicate image. Reusing verdict.", match=previous["match"], dish_name=previous["title"])
+        IDENTIFICATIONS.inc(verdict="unknown" if previous["unknown"] else "known", source="dedupe")
+        return previous["image_url"], previous["title"]
+
+    try:
+        image_url, dish_name, identified = upload_and_identify(image_bytes, user_caption)
+    except Exception as e:
+        IMAGE_INDEX.reject(fingerprint, e, user_caption)
+        raise
 
-        if not image_url:
-            return jsonify({"error": "Image upload did not return a URL."}), 500
+    # Only a real verdict goes in the index; API errors are worth retrying
+    IMAGE_INDEX.resolve(
+        fingerprint, image_url, dish_name, user_caption, unknown=dish_name == UNKNOWN_DISH, store=identified
+    )
+    return image_url, dish_name
 
-        # -------- DISH NAME GENERATION --------
+
+def upload_and_identify(image_bytes, user_caption=""):
+    """Preprocess, then upload and identify in parallel. Returns (image_url, dish_name, identified).
+
+    identified is False when the vision call failed (dish_name is then UNKNOWN_DISH).
+    """
+    # -------- PREPROCESS: orient, downscale, re-encode, strip metadata --------
+    with stage_timer("preprocess"):
+        prepared = IMAGE_PREPROCESSOR.prepare(image_bytes)
+    if prepared.reencoded:
+        PREPROCESS_BYTES_SAVED.inc(max(0, prepared.bytes_saved))
+        log(
+            "🪶 Preprocessed image", width=prepared.width, height=prepared.height,
+            original_bytes=prepared.original_size, bytes=len(prepared.data), bytes_saved=prepared.bytes_saved,
+        )
+    image_bytes = prepared.data
+
+    # Start the Cloudinary upload and identify from the inline image in parallel
+    public_id = f"dish_{uuid.uuid4().hex[:10]}"
+    upload_future = submit_in_context(UPLOAD_POOL, upload_image, image_bytes, public_id)
+
+    # -------- DISH NAME GENERATION --------
+    identified = False
+    try:
+        with stage_timer("identify"):
+            dish_name = identify_dish(image_data_url(image_bytes), user_caption)
+        identified = True
+    except Exception as e:
+        log("🔥 Error during dish name generation", error=str(e))
+        dish_name = UNKNOWN_DISH
+
+    verdict = "error" if not identified else "unknown" if dish_name == UNKNOWN_DISH else "known"
+    IDENTIFICATIONS.inc(verdict=verdict, source="vision")
+    log("✅ Parsed dish name", dish_name=dish_name)
+
+    if dish_name == UNKNOWN_DISH:
+        discard_upload(upload_future, public_id)
+        return None, dish_name, identified
+
+    # Join the upload before building the response
+    try:
+        image_url = upload_future.result()
+    except Exception as e:
+        raise AnalyzeError({"error": "Cloudinary upload failed", "details": str(e)}, 500)
+
+    if not image_url:
+        raise AnalyzeError({"error": "Image upload did not return a URL."}, 500)
+
+    return image_url, dish_name, True
+
+
+def build_result(dish_name, image_url, details):
+    return {
+        "title": dish_name,
+        "description": details["description"],
+        "healthyRecipe": details["healthyRecipe"],
+        "mimicRecipe": details["mimicRecipe"],
+        "imageUrl": image_url
+    }
+
+
+def analyze_image(image_bytes, user_caption="", get_details=get_dish_details):
+    """The whole /analyze pipeline for one image. Returns (payload, cache_status).
+
+    The payload is exactly what /analyze returns: the unknown-dish trigger or the full
+    result. Raises AnalyzeError for upload failures.
+    """
+    image_url, dish_name = resolve_dish(image_bytes, user_caption)
+
+    # --- EARLY EXIT: Unknown Dish ---
+    if dish_name == UNKNOWN_DISH:
+        log("⚠️ GPT could not identify dish. Returning early with trigger for Flutter popup.")
+        return {"trigger": "show_unknown_popup"}, None  # ✅ FLUTTER WILL DETECT THIS
+
+    # -------- DESCRIPTION + RECIPES (cached, concurrent on miss) --------
+    details, cache_status = get_details(dish_name, user_caption)
+    DISH_CACHE_LOOKUPS.inc(status=cache_status)
+    log("🗃️ Dish cache lookup", status=cache_status, dish_name=dish_name)
+    return build_result(dish_name, image_url, details), cache_status
+
+
+# -------- ADMISSION CONTROL --------
+# Analyses hold a worker thread for up to a few minutes, so they're admitted through a
+# bounded slot pool + wait queue. When both are full callers get a fast 429/503 with
+# Retry-After instead of silently queueing until the client's 120s timeout. ADMISSION
+# itself is created under GENERATION STAGES, since the generation pool is sized from it.
+ADMISSION_REJECTIONS = REGISTRY.register(Counter(
+    "admission_rejections_total", "Analyses turned away by admission control.", ("status",)
+))
+REGISTRY.register(GaugeFunc("analyses_in_flight", "Analyses currently holding a slot.", lambda: ADMISSION.in_flight))
+REGISTRY.register(GaugeFunc("analyses_queued", "Analyses waiting for a slot.", lambda: ADMISSION.queued))
+DRAIN_TIMEOUT = int(os.getenv("DRAIN_TIMEOUT", "180"))
+
+
+def admitted(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
         try:
-            system_prompt = (
-                "You are a culinary expert. Return ONLY a JSON object like: "
-                "{\"title\": \"Chicken Alfredo\"}. No explanation. No markdown. Just clean JSON."
-            )
-
-            user_message = [
-                {"type": "text", "text": "What is the name of this dish? If not a food fish return the unknown JSON. Return only JSON."},
-                {"type": "image_url", "image_url": {"url": image_url}},
-            ]
-            if user_caption:
-                user_message.insert(0, {"type": "text", "text": f"User also says: {user_caption}"})
-
-            name_response = openai.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                max_tokens=100,
-                timeout=30
-            )
-
-            raw_json = name_response.choices[0].message.content.strip()
-            print(f"Raw GPT JSON response: {raw_json}")
+            admitted_at = ADMISSION.acquire()
+        except AdmissionRejected as e:
+            ADMISSION_REJECTIONS.inc(status=e.status)
+            log("🚦 Rejected request", path=request.path, reason=e.reason, retry_after=e.retry_after)
+            response = jsonify({"error": e.reason})
+            response.status_code = e.status
+            response.headers["Retry-After"] = str(e.retry_after)
+            return response
+
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception:
+            ADMISSION.release(admitted_at)
+            raise
+        # Released on close, so streaming responses keep their slot until the last line is sent
+        response.call_on_close(lambda: ADMISSION.release(admitted_at))
+        return response
+
+    return wrapper
+
+
+def install_drain_handler():
+    """On SIGTERM, stop admitting new analyses and let in-flight ones finish.
+
+    Under gunicorn the worker's own handler is chained, and gunicorn waits up to its
+    graceful_timeout for open requests. Under the dev server we wait here ourselves.
+    """
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def drain_then_exit():
+        if not ADMISSION.wait_idle(DRAIN_TIMEOUT):
+            log("⚠️ Drain timed out", drain_timeout=DRAIN_TIMEOUT, in_flight=ADMISSION.in_flight)
+        os._exit(0)
+
+    def on_sigterm(signum, frame):
+        log("🛑 SIGTERM: draining in-flight analyses", in_flight=ADMISSION.in_flight)
+        ADMISSION.start_draining()
+        if callable(previous):
+            previous(signum, frame)
+        else:
+            threading.Thread(target=drain_then_exit, name="drain", daemon=True).start()
+
+    try:
+        signal.signal(signal.SIGTERM, on_sigterm)
+    except ValueError:
+        pass  # Not imported on the main thread (e.g. some test runners); nothing to hook
+
+
+install_drain_handler()
+
+
+# -------- REQUEST TRACING --------
+# Every request gets a trace ID (or keeps the caller's X-Request-ID) that tags all its
+# log lines, including those from pool threads. Buffered responses also carry a
+# Server-Timing header with per-stage durations.
+@app.before_request
+def start_trace():
+    current_trace.set(RequestTrace((request.headers.get("X-Request-ID") or "")[:64] or None))
+
+
+@app.after_request
+def finish_trace(response):
+    trace = current_trace.get()
+    if trace is None:
+        return response
+
+    response.headers["X-Request-ID"] = trace.trace_id
+    # A streamed body hasn't been produced yet, so there are no stage timings to report
+    if not response.is_streamed:
+        response.headers["Server-Timing"] = trace.server_timing()
+
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    status = response.status_code
+
+    def record():
+        HTTP_SECONDS.observe(time.perf_counter() - trace.started, route=route)
+        HTTP_REQUESTS.inc(route=route, status=status)
+
+    response.call_on_close(record)
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    if request.path == "/analyze/batch":
+        return jsonify(batch_too_large_payload()), 413
+    return jsonify(upload_too_large_payload()), 413
+
+
+@app.route("/analyze", methods=["POST"])
+@admitted
+def analyze():
+    try:
+        with stage_timer("decode"):
+            image_bytes, user_caption = read_analyze_request()
+        payload, cache_status = analyze_image(image_bytes, user_caption)
+
+        # ✅ Final JSON return
+        response = jsonify(payload)
+        if cache_status:
+            response.headers["X-Dish-Cache"] = cache_status
+        return response
+
+    except AnalyzeError as e:
+        return jsonify(e.payload), e.status
+    except Exception as e:
+        log("🔥 Global error during analysis", error=str(e))
+        return jsonify({"error": str(e)}), 500
+
+
+# -------- STREAMING ANALYZE --------
+# Same pipeline as /analyze, but written as NDJSON (one JSON object per line) so the
+# client can render each section as soon as it exists:
+#   {"event": "title", "title": ..., "imageUrl": ...}   or   {"event": "trigger", "trigger": "show_unknown_popup"}
+#   {"event": "description_delta", "delta": ...}         (zero or more, token-level)
+#   {"event": "description", "description": ...}
+#   {"event": "healthyRecipe", "healthyRecipe": ...}     (recipes in completion order)
+#   {"event": "mimicRecipe", "mimicRecipe": ...}
+#   {"event": "done", "result": {...}}                   (identical to the /analyze JSON, trigger included)
+def ndjson(event, **fields):
+    return json.dumps({"event": event, **fields}) + "\n"
+
 
+def generate_streamed_details(cache_key, dish_name, user_caption, events):
+    """Owner side of a streamed cache miss: generate, put NDJSON lines on `events`, then None.
+
+    Runs on its own thread rather than in the response generator, so the cache entry is
+    resolved (and anyone coalesced onto it gets their result) even if this client
+    disconnects halfway through.
+    """
+    try:
+        deltas = queue.Queue()
+        desc_task = StageTask(GENERATION_POOL, generate_streamed_description, deltas, dish_name, user_caption)
+        recipe_stages = {
+            StageTask(GENERATION_POOL, generate_healthy_recipe, dish_name): ("healthyRecipe", "healthy_recipe", empty_recipe("Healthy Version")),
+            StageTask(GENERATION_POOL, generate_mimic_recipe, dish_name): ("mimicRecipe", "mimic_recipe", empty_recipe("Mimic Version")),
+        }
+
+        # The final "description" event is authoritative: on a mid-stream failure it replaces
+        # whatever deltas were already sent with the usual fallback text.
+        deadline = desc_task.wait_started() + DESCRIPTION_TIMEOUT + STAGE_GRACE
+        while True:
             try:
-                parsed = json.loads(raw_json)
-                dish_name = parsed.get("title") or parsed.get("dish_name") or ""
-            except json.JSONDecodeError:
-                dish_name = ""
-
-            dish_name = dish_name.strip()
-
-            # Validate the dish name
-            if (
-                not dish_name
-                or not isinstance(dish_name, str)
-                or dish_name.lower() in {"dish", "food", "unknown", "none"}
-                or not re.search(r"[A-Za-z]{3,}", dish_name)
-            ):
-                dish_name = "Unknown Dish"
+                delta = deltas.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break  # Out of time: await_stage hands back the fallback
+            if delta is None:
+                break
+            events.put(ndjson("description_delta", delta=delta))
 
-        except Exception as e:
-            print("🔥 Error during dish name generation:", e)
-            dish_name = "Unknown Dish"
+        description = await_stage(desc_task, "description", DESCRIPTION_TIMEOUT, DESCRIPTION_FALLBACK)
+        details = {"description": description}
+        events.put(ndjson("description", description=description))
 
-        print(f"✅ Parsed dish name: '{dish_name}'")
+        for task in stages_in_completion_order(recipe_stages, RECIPE_TIMEOUT):
+            key, name, fallback = recipe_stages[task]
+            details[key] = await_stage(task, name, RECIPE_TIMEOUT, fallback)
+            events.put(ndjson(key, **{key: details[key]}))
 
-        # --- EARLY EXIT: Unknown Dish ---
-        if dish_name == "Unknown Dish":
-            print("⚠️ GPT could not identify dish. Returning early with trigger for Flutter popup.")
-            return jsonify({"trigger": "show_unknown_popup"}), 200  # ✅ FLUTTER WILL DETECT THIS
+        DISH_CACHE.resolve(cache_key, details, store=is_complete_details(details))
+    except Exception as e:
+        DISH_CACHE.reject(cache_key, e)
+    finally:
+        events.put(None)
 
-    # -------- DESCRIPTION GENERATION --------
-        try:
-            prompt = f"Describe the dish '{dish_name}' in two clean and precise yet descriptive sentences."
-            if user_caption:
-                prompt += f" User also described it as: \"{user_caption}\""
-
-            desc_response = openai.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": (
-                        "You are a culinary expert. Write an accurate description describing the dish you see in the image."
-                        "Mention ingredients, flavors, and textures."
-                    )},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=300,
-                timeout=30
-            )
-            description = desc_response.choices[0].message.content.strip()
-        except Exception as e:
-            print("🔥 Error during description:", e)
-            description = "No description available."
 
-        # -------- HEALTHY RECIPE --------
+def stream_dish_details(dish_name, user_caption=""):
+    """Yield NDJSON events for description and recipes; returns the merged details dict.
+
+    Shares DISH_CACHE's single-flight map with /analyze. Hits, and requests that coalesce
+    onto a generation already running (streamed or not), get the finished sections
+    replayed. Only the request that owns the miss streams description deltas live; its
+    stages run on the generation pool and the merged result is cached when every stage
+    succeeded.
+    """
+    cache_key = make_cache_key(dish_name, user_caption)
+    status, found = DISH_CACHE.claim(cache_key)
+    DISH_CACHE_LOOKUPS.inc(status=status)
+    log("🗃️ Dish cache lookup", status=status, dish_name=dish_name, stream=True)
+
+    if status != "MISS":
+        details = found if status == "HIT" else found.result()
+        yield ndjson("description", description=details["description"])
+        yield ndjson("healthyRecipe", healthyRecipe=details["healthyRecipe"])
+        yield ndjson("mimicRecipe", mimicRecipe=details["mimicRecipe"])
+        return details
+
+    events = queue.Queue()
+    threading.Thread(
+        target=contextvars.copy_context().run,
+        args=(generate_streamed_details, cache_key, dish_name, user_caption, events),
+        name="dish-stream",
+        daemon=True,
+    ).start()
+    yield from iter(events.get, None)
+    return found.result()
+
+
+@app.route("/analyze/stream", methods=["POST"])
+@admitted
+def analyze_stream():
+    try:
+        with stage_timer("decode"):
+            image_bytes, user_caption = read_analyze_request()
+    except AnalyzeError as e:
+        return jsonify(e.payload), e.status
+    except Exception as e:
+        log("🔥 Global error during analysis", error=str(e))
+        return jsonify({"error": str(e)}), 500
+
+    def events():
         try:
-            healthy_response = openai.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": (
-                        "You are a professional chef and nutritionist. Generate a structured JSON for a healthier version of the given dish. "
-                        "JSON format only. No markdown or explanations. Format:\n"
-                        "{"
-                        "\"title\": \"string\", "
-                        "\"ingredients\": [\"string\"], "
-                        "\"instructions\": [\"string\"], "
-                        "\"servings\": int, "
-                        "\"prepTime\": \"string\", "
-                        "\"cookTime\": \"string\", "
-                        "\"nutrition\": {\"calories\": int, \"protein\": \"string\", \"carbs\": \"string\", \"fat\": \"string\"}"
-                        "}"
-                    )},
-                    {"role": "user", "content": f"Give a healthier recipe for the '{dish_name}' using that JSON structure."}
-                ],
-                max_tokens=1000,
-                timeout=60
-            )
-            healthy_recipe = json.loads(healthy_response.choices[0].message.content.strip())
+            image_url, dish_name = resolve_dish(image_bytes, user_caption)
+
+            if dish_name == UNKNOWN_DISH:
+                log("⚠️ GPT could not identify dish. Streaming trigger for Flutter popup.")
+                yield ndjson("trigger", trigger="show_unknown_popup")
+                yield ndjson("done", result={"trigger": "show_unknown_popup"})
+                return
+
+            yield ndjson("title", title=dish_name, imageUrl=image_url)
+            details = yield from stream_dish_details(dish_name, user_caption)
+            yield ndjson("done", result=build_result(dish_name, image_url, details))
+
+        except AnalyzeError as e:
+            yield ndjson("error", status=e.status, **e.payload)
         except Exception as e:
-            print("🔥 Error during healthy recipe:", e)
-            healthy_recipe = {
-                "title": "Healthy Version",
-                "ingredients": [],
-                "instructions": [],
-                "servings": 0,
-                "prepTime": "",
-                "cookTime": "",
-                "nutrition": {}
-            }
-
-        # -------- MIMIC RECIPE --------
+            log("🔥 Global error during streaming analysis", error=str(e))
+            yield ndjson("error", status=500, error=str(e))
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# -------- BATCH ANALYZE --------
+# Offline jobs (re-analyzing "My Dishes", seeding demo content) send many images at once.
+# Items run on a bounded per-batch pool; upstream calls are still capped by the global
+# OPENAI_LIMIT / CLOUDINARY_LIMIT. A batch only holds one admission slot, so batch items
+# are also capped process-wide (BATCH_MAX_ACTIVE_ITEMS) and generate on their own, smaller
+# pool: however many batches are running, interactive requests keep GENERATION_POOL.
+# Results stream back as NDJSON in completion order:
+#   {"event": "item", "index": 0, "id": ..., "status": 200, "cache": "MISS", "result": {...}}
+#   {"event": "item", "index": 1, "id": ..., "status": 400, "error": {"error": ...}}
+#   {"event": "done", "total": 2, "succeeded": 1, "failed": 1}
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "8"))
+BATCH_DEFAULT_WORKERS = 4
+# Replaces MAX_CONTENT_LENGTH for this route: ~50 phone photos, base64-encoded in JSON
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(200 * 1024 * 1024)))
+BATCH_MAX_ACTIVE_ITEMS = int(os.getenv("BATCH_MAX_ACTIVE_ITEMS", "4"))
+
+BATCH_ITEM_LIMIT = threading.BoundedSemaphore(BATCH_MAX_ACTIVE_ITEMS)
+BATCH_GENERATION_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BATCH_GENERATION_WORKERS", str(3 * BATCH_MAX_ACTIVE_ITEMS))),
+    thread_name_prefix="batch-gen",
+)
+
+
+class BatchDetails:
+    """Per-batch memo so items that resolve to the same dish share one generation.
+
+    DISH_CACHE already coalesces concurrent misses, but it never stores fallbacks; this
+    keeps "once per dish per batch" true even when a generation degraded.
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def get(self, dish_name, user_caption=""):
+        key = make_cache_key(dish_name, user_caption)
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._futures[key] = future
+
+        if not owner:
+            details, _ = future.result()
+            return details, "BATCH"
+
         try:
-            mimic_response = openai.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": (
-                        "You are a professional chef. Generate a structured JSON recipe that closely mimics the original dish. "
-                        "JSON format only. No markdown or hashtags. Format:\n"
-                        "{"
-                        "\"title\": \"string\", "
-                        "\"ingredients\": [\"string\"], "
-                        "\"instructions\": [\"string\"], "
-                        "\"servings\": int, "
-                        "\"prepTime\": \"string\", "
-                        "\"cookTime\": \"string\", "
-                        "\"nutrition\": {\"calories\": int, \"protein\": \"string\", \"carbs\": \"string\", \"fat\": \"string\"}"
-                        "}"
-                    )},
-                    {"role": "user", "content": f"Create a mimic recipe for the '{dish_name}' using that JSON structure."}
-                ],
-                max_tokens=1000,
-                timeout=60
-            )
-            mimic_recipe = json.loads(mimic_response.choices[0].message.content.strip())
+            value = get_dish_details(dish_name, user_caption, pool=BATCH_GENERATION_POOL)
+            future.set_result(value)
+            return value
         except Exception as e:
-            print("🔥 Error during mimic recipe:", e)
-            mimic_recipe = {
-                "title": "Mimic Version",
-                "ingredients": [],
-                "instructions": [],
-                "servings": 0,
-                "prepTime": "",
-                "cookTime": "",
-                "nutrition": {}
-            }
+            future.set_exception(e)
+            raise
+
+
+def load_batch_image(item):
+    """Bytes for a batch item: raw bytes, base64 text (HTTP) or a local path (CLI)."""
+    if item.get("path"):
+        with open(item["path"], "rb") as f:
+            return f.read()
+
+    image = item.get("image")
+    if not image:
+        raise AnalyzeError({"error": "No image provided"}, 400)
+    if isinstance(image, bytes):
+        return image
+    if not isinstance(image, str):
+        raise AnalyzeError({"error": "Invalid base64 image"}, 400)
+    try:
+        # Strict, so junk like "!!!" is a 400 instead of an empty image; line breaks are fine
+        image_bytes = base64.b64decode("".join(image.split()), validate=True)
+    except ValueError:
+        raise AnalyzeError({"error": "Invalid base64 image"}, 400)
+    if not image_bytes:
+        raise AnalyzeError({"error": "No image provided"}, 400)
+    return image_bytes
 
-        # ✅ Final JSON return
-        return jsonify({
-            "title": dish_name,
-            "description": description,
-            "healthyRecipe": healthy_recipe,
-            "mimicRecipe": mimic_recipe,
-            "imageUrl": image_url
-        })
 
+def analyze_batch_item(index, item, batch_details):
+    entry = {"index": index, "id": item.get("id", index)}
+    try:
+        image_bytes = load_batch_image(item)
+        with BATCH_ITEM_LIMIT:
+            result, cache_status = analyze_image(image_bytes, item.get("caption", ""), get_details=batch_details.get)
+        return {**entry, "status": 200, "cache": cache_status, "result": result}
+    except AnalyzeError as e:
+        return {**entry, "status": e.status, "error": e.payload}
     except Exception as e:
-        print("🔥 Global error during analysis:", str(e))
+        log("🔥 Error analyzing batch item", item_id=entry["id"], error=str(e))
+        return {**entry, "status": 500, "error": {"error": str(e)}}
+
+
+def run_batch(items, concurrency=BATCH_DEFAULT_WORKERS):
+    """Yield one result dict per item, in completion order. Never raises for a single item."""
+    batch_details = BatchDetails()
+    workers = max(1, min(concurrency, BATCH_MAX_WORKERS, len(items) or 1))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+    try:
+        futures = [
+            submit_in_context(pool, analyze_batch_item, i, item, batch_details) for i, item in enumerate(items)
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # If the consumer goes away (client disconnect), don't start the rest of the batch
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def batch_too_large_payload():
+    return {"error": f"Batch too large. Max batch request size is {BATCH_MAX_BYTES // (1024 * 1024)} MB."}
+
+
+def read_batch_request():
+    """Return (items, concurrency).
+
+    Accepts JSON `{"images": [{"id": ..., "image": "<base64>", "caption": ...}], "concurrency": 4}`
+    or multipart/form-data with repeated `images` file parts, optional repeated
+    `captions` fields (matched by position) and a `concurrency` field.
+    """
+    request.max_content_length = BATCH_MAX_BYTES
+    try:
+        if request.mimetype == "multipart/form-data":
+            uploads = request.files.getlist("images")
+            captions = request.form.getlist("captions")
+            items = [
+                {
+                    "id": upload.filename or i,
+                    "image": upload.stream.getvalue(),
+                    "caption": captions[i] if i < len(captions) else "",
+                }
+                for i, upload in enumerate(uploads)
+            ]
+            concurrency = request.form.get("concurrency", BATCH_DEFAULT_WORKERS)
+        else:
+            data = request.get_json(force=True)
+            raw_items = data.get("images") or []
+            if not isinstance(raw_items, list):
+                raise AnalyzeError({"error": "\"images\" must be a list"}, 400)
+            # Only copy the fields we know: "path" is for the local CLI, never for HTTP clients
+            items = [
+                {
+                    "id": raw.get("id", i) if isinstance(raw, dict) else i,
+                    "image": raw.get("image") if isinstance(raw, dict) else raw,
+                    "caption": str(raw.get("caption", "")).strip() if isinstance(raw, dict) else "",
+                }
+                for i, raw in enumerate(raw_items)
+            ]
+            concurrency = data.get("concurrency", BATCH_DEFAULT_WORKERS)
+    except RequestEntityTooLarge:
+        raise AnalyzeError(batch_too_large_payload(), 413)
+
+    if not items:
+        raise AnalyzeError({"error": "No images provided"}, 400)
+    if len(items) > BATCH_MAX_ITEMS:
+        raise AnalyzeError({"error": f"Too many images. Max batch size is {BATCH_MAX_ITEMS}."}, 400)
+
+    try:
+        concurrency = int(concurrency)
+    except (TypeError, ValueError):
+        raise AnalyzeError({"error": "\"concurrency\" must be an integer"}, 400)
+
+    return items, concurrency
+
+
+@app.route("/analyze/batch", methods=["POST"])
+@admitted
+def analyze_batch():
+    try:
+        items, concurrency = read_batch_request()
+    except AnalyzeError as e:
+        return jsonify(e.payload), e.status
+    except Exception as e:
+        log("🔥 Global error during batch analysis", error=str(e))
         return jsonify({"error": str(e)}), 500
 
+    def events():
+        succeeded = 0
+        for item in run_batch(items, concurrency):
+            succeeded += item["status"] == 200
+            yield ndjson("item", **item)
+        yield ndjson("done", total=len(items), succeeded=succeeded, failed=len(items) - succeeded)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/cloudinary-signature", methods=["POST"])
 def generate_signature():
     try:
@@ -274,11 +1204,12 @@ def generate_signature():
         })
 
     except Exception as e:
-        print(f"[❌ CLOUDINARY SIGNATURE ERROR] {e}")
+        log("[❌ CLOUDINARY SIGNATURE ERROR]", error=str(e))
         return jsonify({
             "error": "Failed to generate signature",
             "details": str(e)
         }), 500
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+    # Development server. For production: gunicorn -c gunicorn.conf.py server:app
+    app.run(host="0.0.0.0", port=int(os.getenv("PORT", "5000")), threaded=True)
@@ -0,0 +1,161 @@
+import contextvars
+import json
+import math
+import sys
+import threading
+import time
+import uuid
+
+# The RequestTrace of the request being handled. Pools that run request work must
+# submit through `submit_in_context` so their threads see (and add to) the same trace.
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class RequestTrace:
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.timings = []  # (stage, seconds), in completion order
+        self._lock = threading.Lock()
+
+    def add_timing(self, stage, seconds):
+        with self._lock:
+            self.timings.append((stage, seconds))
+
+    def server_timing(self):
+        """`Server-Timing` header value, e.g. `identify;dur=812.4, total;dur=1503.9`."""
+        with self._lock:
+            entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.timings]
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+def submit_in_context(pool, fn, *args, **kwargs):
+    """pool.submit, but the task runs with the caller's contextvars (trace included)."""
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# None means sys.stdout, looked up on every write
+_log_stream = None
+
+
+def set_log_stream(stream):
+    """Send log records to `stream`, e.g. stderr for tools whose results go to stdout."""
+    global _log_stream
+    _log_stream = stream
+
+
+def log(msg, **fields):
+    """One JSON line per event, tagged with the current request's trace ID."""
+    trace = current_trace.get()
+    record = {"ts": round(time.time(), 3), "trace_id": trace.trace_id if trace else None, "msg": msg}
+    record.update(fields)
+    stream = _log_stream or sys.stdout
+    # A single write per line so records from concurrent threads don't interleave
+    stream.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    stream.flush()
+
+
+# -------- PROMETHEUS METRICS --------
+# A tiny in-process registry that renders the Prometheus text format; enough for
+# counters, histograms and callback gauges without another dependency.
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in items]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=(0.1, 0.5, 1, 5, 10, 30, 60)):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        lines = []
+        for key, series in items:
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class GaugeFunc:
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn):
+        self.name = name
+        self.help_text = help_text
+        self.fn = fn
+
+    def samples(self):
+        return [f"{self.name} {_number(self.fn())}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def acquire_in_thread(controller):
+    """Start acquire() on a thread; returns (thread, outcome) where outcome gets the result."""
+    outcome = {}
+
+    def run():
+        try:
+            outcome["admitted_at"] = controller.acquire()
+        except AdmissionRejected as e:
+            outcome["rejected"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, outcome
+
+
+def wait_for_queued(controller, count):
+    deadline = time.monotonic() + 5
+    while controller.queued < count:
+        assert time.monotonic() < deadline, "request never queued"
+        time.sleep(0.01)
+
+
+def test_admits_up_to_max_in_flight_without_waiting():
+    controller = AdmissionController(max_in_flight=2, max_queue=0)
+    controller.acquire()
+    controller.acquire()
+    assert controller.in_flight == 2
+
+
+def test_full_queue_rejects_with_429():
+    controller = AdmissionController(max_in_flight=1, max_queue=0)
+    controller.acquire()
+
+    with pytest.raises(AdmissionRejected) as e:
+        controller.acquire()
+    assert e.value.status == 429
+    assert 1 <= e.value.retry_after <= 120
+
+
+def test_queue_timeout_rejects_with_503():
+    controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=0.1)
+    controller.acquire()
+
+    with pytest.raises(AdmissionRejected) as e:
+        controller.acquire()
+    assert e.value.status == 503
+    assert e.value.reason == "Timed out waiting for capacity"
+    assert controller.queued == 0
+
+
+def test_queued_request_is_admitted_when_a_slot_frees_up():
+    controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=5)
+    admitted_at = controller.acquire()
+    thread, outcome = acquire_in_thread(controller)
+    wait_for_queued(controller, 1)
+
+    controller.release(admitted_at)
+    thread.join(5)
+    assert "admitted_at" in outcome
+    assert (controller.in_flight, controller.queued) == (1, 0)
+
+
+def test_draining_rejects_new_and_queued_requests_with_503():
+    controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=5)
+    controller.acquire()
+    thread, outcome = acquire_in_thread(controller)
+    wait_for_queued(controller, 1)
+
+    controller.start_draining()
+    thread.join(5)
+    assert outcome["rejected"].status == 503
+    assert outcome["rejected"].reason == "Server is shutting down"
+    with pytest.raises(AdmissionRejected) as e:
+        controller.acquire()
+    assert e.value.status == 503
+
+
+def test_wait_idle_waits_for_in_flight_requests():
+    controller = AdmissionController(max_in_flight=1)
+    admitted_at = controller.acquire()
+    assert controller.wait_idle(0.05) is False
+
+    threading.Timer(0.1, controller.release, args=(admitted_at,)).start()
+    assert controller.wait_idle(5) is True
+
+
+def test_retry_after_grows_with_the_queue():
+    controller = AdmissionController(max_in_flight=2)
+    first = controller.retry_after()
+    controller.queued = 5
+    assert controller.retry_after() > first
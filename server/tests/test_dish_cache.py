@@ -0,0 +1,156 @@
+import threading
+import time
+
+import pytest
+
+import dish_cache
+from dish_cache import DishCache, make_cache_key, normalize_dish_name
+
+
+def test_normalize_dish_name():
+    assert normalize_dish_name("  Chicken   Alfredo! ") == "chicken alfredo"
+
+
+def test_cache_key_includes_caption_only_when_given():
+    assert make_cache_key("Pad Thai") == "pad thai"
+    assert make_cache_key("Pad Thai", "  Extra   Spicy ") == "pad thai|extra spicy"
+
+
+# -------- memory layer --------
+def test_lru_evicts_least_recently_used():
+    cache = DishCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the oldest
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(dish_cache.time, "time", lambda: now[0])
+    cache = DishCache(ttl_seconds=60)
+    cache.put("a", 1)
+
+    now[0] += 59
+    assert cache.get("a") == 1
+    now[0] += 2
+    assert cache.get("a") is None
+
+
+# -------- disk layer --------
+def test_sqlite_store_survives_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    DishCache(path=path).put("pad thai", {"description": "Noodles."})
+
+    assert DishCache(path=path).get("pad thai") == {"description": "Noodles."}
+
+
+def test_sqlite_drops_expired_rows_on_open(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.sqlite3")
+    now = [1000.0]
+    monkeypatch.setattr(dish_cache.time, "time", lambda: now[0])
+    DishCache(path=path, ttl_seconds=60).put("a", 1)
+
+    now[0] += 61
+    reopened = DishCache(path=path, ttl_seconds=60)
+    assert reopened.get("a") is None
+    assert reopened._db.execute("SELECT COUNT(*) FROM dish_cache").fetchone()[0] == 0
+
+
+def test_unusable_store_falls_back_to_memory(tmp_path):
+    cache = DishCache(path=str(tmp_path / "missing" / "cache.sqlite3"))
+    cache.put("a", 1)
+    assert cache._db is None
+    assert cache.get("a") == 1
+
+
+# -------- single flight --------
+def test_claim_hands_non_owners_the_owners_future():
+    cache = DishCache()
+    status, owner_future = cache.claim("a")
+    assert status == "MISS"
+
+    status, waiter_future = cache.claim("a")
+    assert status == "COALESCED"
+    assert waiter_future is owner_future
+
+    cache.resolve("a", 1)
+    assert waiter_future.result(timeout=1) == 1
+    assert cache.claim("a") == ("HIT", 1)
+    assert cache._in_flight == {}
+
+
+def test_resolve_without_store_releases_key_but_does_not_cache():
+    cache = DishCache()
+    _, future = cache.claim("a")
+    cache.resolve("a", "fallback", store=False)
+
+    assert future.result(timeout=1) == "fallback"
+    assert cache.get("a") is None
+    assert cache.claim("a")[0] == "MISS"
+
+
+def test_reject_fails_waiters_and_releases_key():
+    cache = DishCache()
+    _, future = cache.claim("a")
+    cache.reject("a", RuntimeError("boom"))
+
+    with pytest.raises(RuntimeError):
+        future.result(timeout=1)
+    assert cache._in_flight == {}
+
+
+def test_get_or_compute_runs_compute_once_for_concurrent_misses():
+    cache = DishCache()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return {"description": "Noodles."}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_compute("pad thai", compute)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    while "pad thai" not in cache._in_flight:
+        time.sleep(0.01)
+    time.sleep(0.1)  # Let the other callers reach the in-flight Future
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(status for _, status in results) == ["COALESCED"] * 4 + ["MISS"]
+    assert all(value == {"description": "Noodles."} for value, _ in results)
+    assert cache.get_or_compute("pad thai", compute) == ({"description": "Noodles."}, "HIT")
+    assert cache._in_flight == {}
+
+
+def test_get_or_compute_does_not_store_rejected_values():
+    cache = DishCache()
+    value, status = cache.get_or_compute("a", lambda: "fallback", should_store=lambda v: v != "fallback")
+
+    assert (value, status) == ("fallback", "MISS")
+    assert cache.get("a") is None
+    assert cache._in_flight == {}
+
+
+def test_get_or_compute_failure_is_not_sticky():
+    cache = DishCache()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute("a", fail)
+    assert cache._in_flight == {}
+    assert cache.get_or_compute("a", lambda: 1) == (1, "MISS")
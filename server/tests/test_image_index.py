@@ -0,0 +1,129 @@
+import io
+from types import SimpleNamespace
+
+import pytest
+
+from image_index import ImageFingerprint, ImageIndex, dhash
+
+
+def fingerprint(sha256, dhash_value):
+    return SimpleNamespace(sha256=sha256, dhash=dhash_value)
+
+
+def test_exact_match_requires_same_caption():
+    index = ImageIndex()
+    index.record(fingerprint("abc", None), "https://img/1", "Pad Thai", user_caption="spicy")
+
+    match = index.lookup(fingerprint("abc", None), "spicy")
+    assert match["match"] == "exact"
+    assert match["title"] == "Pad Thai"
+    assert index.lookup(fingerprint("abc", None), "") is None
+
+
+def test_perceptual_match_within_max_distance():
+    index = ImageIndex(max_distance=4)
+    index.record(fingerprint("a", 0b0000), "https://img/1", "Pad Thai")
+
+    match = index.lookup(fingerprint("b", 0b1111))  # 4 bits apart
+    assert match["match"] == "perceptual"
+    assert match["distance"] == 4
+    assert index.lookup(fingerprint("c", 0b11111)) is None  # 5 bits apart
+
+
+def test_perceptual_match_is_per_caption():
+    index = ImageIndex(max_distance=4)
+    index.record(fingerprint("a", 0), "https://img/1", "Pad Thai", user_caption="spicy")
+
+    assert index.lookup(fingerprint("b", 1), "mild") is None
+    assert index.lookup(fingerprint("b", 1), "spicy")["title"] == "Pad Thai"
+
+
+def test_unknown_verdicts_use_their_own_threshold():
+    index = ImageIndex(max_distance=2, unknown_max_distance=6)
+    index.record(fingerprint("a", 0), None, "Unknown Dish", unknown=True)
+
+    match = index.lookup(fingerprint("b", 0b111111))  # 6 bits apart
+    assert match["unknown"] is True
+    assert index.lookup(fingerprint("c", 0b1111111)) is None
+
+
+def test_closest_candidate_wins():
+    index = ImageIndex(max_distance=4)
+    index.record(fingerprint("far", 0b0111), "https://img/far", "Far")
+    index.record(fingerprint("near", 0b0001), "https://img/near", "Near")
+
+    assert index.lookup(fingerprint("query", 0))["title"] == "Near"
+
+
+def test_without_dhash_only_exact_matches():
+    index = ImageIndex()
+    index.record(fingerprint("a", 0), "https://img/1", "Pad Thai")
+
+    assert index.lookup(fingerprint("b", None)) is None
+
+
+def test_lru_eviction_keeps_recently_used_entries():
+    index = ImageIndex(max_entries=2, max_distance=0)
+    index.record(fingerprint("a", None), "https://img/a", "A")
+    index.record(fingerprint("b", None), "https://img/b", "B")
+    index.lookup(fingerprint("a", None))  # "b" is now the oldest
+    index.record(fingerprint("c", None), "https://img/c", "C")
+
+    assert index.lookup(fingerprint("b", None)) is None
+    assert index.lookup(fingerprint("a", None))["title"] == "A"
+    assert index.lookup(fingerprint("c", None))["title"] == "C"
+
+
+def test_recompressed_photo_is_a_perceptual_match():
+    Image = pytest.importorskip("PIL.Image")
+    img = Image.linear_gradient("L").resize((640, 480)).convert("RGB")
+    original, recompressed = io.BytesIO(), io.BytesIO()
+    img.save(original, format="JPEG", quality=95)
+    img.resize((320, 240)).save(recompressed, format="JPEG", quality=60)
+
+    index = ImageIndex()
+    index.record(ImageFingerprint(original.getvalue()), "https://img/1", "Gradient")
+    match = index.lookup(ImageFingerprint(recompressed.getvalue()))
+    assert match is not None and match["match"] == "perceptual"
+
+
+def test_dhash_of_undecodable_bytes_is_none():
+    pytest.importorskip("PIL")
+    assert dhash(b"not an image") is None
+
+
+# -------- in-flight coalescing --------
+def test_identical_images_in_flight_share_the_first_verdict():
+    index = ImageIndex()
+    status, owner_future = index.claim(fingerprint("abc", 0), "spicy")
+    assert status == "MISS"
+
+    status, waiter_future = index.claim(fingerprint("abc", 0), "spicy")
+    assert status == "COALESCED"
+    assert waiter_future is owner_future
+    assert index.claim(fingerprint("abc", 0), "mild")[0] == "MISS"  # Different caption, different verdict
+
+    index.resolve(fingerprint("abc", 0), "https://img/1", "Pad Thai", "spicy")
+    assert waiter_future.result(timeout=1)["title"] == "Pad Thai"
+    status, entry = index.claim(fingerprint("abc", 0), "spicy")
+    assert (status, entry["match"]) == ("HIT", "exact")
+
+
+def test_resolve_without_store_only_answers_waiters():
+    index = ImageIndex()
+    _, future = index.claim(fingerprint("abc", None))
+    index.resolve(fingerprint("abc", None), None, "Unknown Dish", unknown=True, store=False)
+
+    assert future.result(timeout=1)["unknown"] is True
+    assert index.lookup(fingerprint("abc", None)) is None
+    assert index.claim(fingerprint("abc", None))[0] == "MISS"
+
+
+def test_reject_fails_waiters_and_frees_the_image():
+    index = ImageIndex()
+    _, future = index.claim(fingerprint("abc", None))
+    index.reject(fingerprint("abc", None), RuntimeError("upload failed"))
+
+    with pytest.raises(RuntimeError):
+        future.result(timeout=1)
+    assert index.claim(fingerprint("abc", None))[0] == "MISS"
@@ -0,0 +1,70 @@
+import io
+
+import pytest
+
+from image_prep import ImagePreprocessor
+
+Image = pytest.importorskip("PIL.Image")
+
+ORIENTATION = 0x0112
+MAKE = 0x010F
+
+
+def jpeg(size, quality=90, exif=None):
+    img = Image.effect_noise(size, 40).convert("RGB")
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality, **({"exif": exif} if exif is not None else {}))
+    return out.getvalue()
+
+
+def exif_with(tag, value):
+    exif = Image.Exif()
+    exif[tag] = value
+    return exif
+
+
+def decode(data):
+    return Image.open(io.BytesIO(data))
+
+
+def test_applies_exif_orientation():
+    # Orientation 6: stored landscape, displayed rotated 90° clockwise
+    data = jpeg((200, 100), exif=exif_with(ORIENTATION, 6))
+    prepared = ImagePreprocessor().prepare(data)
+
+    assert prepared.reencoded
+    assert (prepared.width, prepared.height) == (100, 200)
+    assert decode(prepared.data).size == (100, 200)
+
+
+def test_downscales_longest_edge_to_max_edge():
+    prepared = ImagePreprocessor(max_edge=500).prepare(jpeg((1600, 1200)))
+
+    assert prepared.reencoded
+    assert max(decode(prepared.data).size) == 500
+    assert prepared.bytes_saved > 0
+
+
+def test_strips_metadata():
+    data = jpeg((300, 200), exif=exif_with(MAKE, "PhoneMaker"))
+    prepared = ImagePreprocessor().prepare(data)
+
+    assert prepared.reencoded
+    assert not decode(prepared.data).getexif()
+
+
+def test_small_clean_image_passes_through_when_reencoding_would_grow_it():
+    data = jpeg((64, 64), quality=10)
+    prepared = ImagePreprocessor(quality=95).prepare(data)
+
+    assert not prepared.reencoded
+    assert prepared.data is data
+    assert prepared.bytes_saved == 0
+
+
+def test_undecodable_bytes_fall_back_to_the_original():
+    data = b"\xff\xd8\xff\xe0 definitely not a jpeg"
+    prepared = ImagePreprocessor().prepare(data)
+
+    assert not prepared.reencoded
+    assert prepared.data is data
@@ -0,0 +1,117 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+for module in ("dotenv", "flask", "openai", "cloudinary"):
+    pytest.importorskip(module)
+
+os.environ.setdefault("DISH_CACHE_PATH", "")  # Don't leave a cache file behind
+
+import server
+from server import StageTask, await_stage, mark_stage_started, stages_in_completion_order
+
+TIMEOUT = 0.2
+
+
+@pytest.fixture(autouse=True)
+def short_grace(monkeypatch):
+    monkeypatch.setattr(server, "STAGE_GRACE", 0.05)
+
+
+@pytest.fixture
+def pool():
+    pool = ThreadPoolExecutor(max_workers=1)
+    yield pool
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def stage(seconds, result):
+    """A stub stage: its "OpenAI call" starts at once and takes `seconds`."""
+    def run():
+        mark_stage_started()
+        time.sleep(seconds)
+        return result
+    return run
+
+
+def fallbacks(stage_name, outcome):
+    key = (stage_name, outcome)
+    return server.STAGE_FALLBACKS._values.get(key, 0)
+
+
+def test_slow_stage_falls_back_on_its_own():
+    pool = ThreadPoolExecutor(max_workers=3)
+    tasks = {
+        StageTask(pool, stage(0.05, "fast")): "fast",
+        StageTask(pool, stage(1.0, "slow")): "slow",
+        StageTask(pool, stage(0.1, "also fast")): "also_fast",
+    }
+    timeouts_before = fallbacks("slow", "timeout")
+
+    started = time.monotonic()
+    results = {tasks[task]: await_stage(task, tasks[task], TIMEOUT, "fallback") for task in tasks}
+
+    assert results == {"fast": "fast", "slow": "fallback", "also_fast": "also fast"}
+    assert time.monotonic() - started < 0.6  # Didn't wait for the slow stage to finish
+    assert fallbacks("slow", "timeout") == timeouts_before + 1
+    pool.shutdown(wait=False)
+
+
+def test_time_queued_for_the_pool_does_not_count(pool):
+    # One thread, three stages of 0.15s each: the last finishes ~0.45s after submission,
+    # well past TIMEOUT + grace, but each stage is within its deadline once it starts.
+    tasks = [StageTask(pool, stage(0.15, i)) for i in range(3)]
+
+    assert [await_stage(task, f"stage_{i}", TIMEOUT, "fallback") for i, task in enumerate(tasks)] == [0, 1, 2]
+
+
+def test_time_before_the_call_starts_does_not_count(pool):
+    def waits_for_permit():
+        time.sleep(0.3)  # e.g. queued on OPENAI_LIMIT
+        mark_stage_started()
+        time.sleep(0.1)
+        return "done"
+
+    assert await_stage(StageTask(pool, waits_for_permit), "permit", TIMEOUT, "fallback") == "done"
+
+
+def test_failed_stage_falls_back_once(pool):
+    def fails():
+        mark_stage_started()
+        raise RuntimeError("boom")
+
+    errors_before = fallbacks("fails", "error")
+    assert await_stage(StageTask(pool, fails), "fails", TIMEOUT, "fallback") == "fallback"
+    assert fallbacks("fails", "error") == errors_before + 1
+
+
+def test_stages_come_back_in_completion_order():
+    pool = ThreadPoolExecutor(max_workers=3)
+    slow = StageTask(pool, stage(0.15, "slow"))
+    stuck = StageTask(pool, stage(1.0, "stuck"))
+    fast = StageTask(pool, stage(0.01, "fast"))
+
+    order = list(stages_in_completion_order([slow, stuck, fast], TIMEOUT))
+
+    # The stuck stage is handed back once its deadline passes, for await_stage to fall back
+    assert order == [fast, slow, stuck]
+    assert not stuck.future.done()
+    pool.shutdown(wait=False)
+
+
+def test_generate_dish_details_keeps_sections_that_finished(monkeypatch):
+    monkeypatch.setattr(server, "DESCRIPTION_TIMEOUT", TIMEOUT)
+    monkeypatch.setattr(server, "RECIPE_TIMEOUT", TIMEOUT)
+    monkeypatch.setattr(server, "generate_description", lambda name, caption="": stage(0.05, "Noodles.")())
+    monkeypatch.setattr(server, "generate_healthy_recipe", lambda name: stage(1.0, {"title": "Healthy"})())
+    monkeypatch.setattr(server, "generate_mimic_recipe", lambda name: stage(0.05, {"title": "Mimic"})())
+    pool = ThreadPoolExecutor(max_workers=3)
+
+    description, healthy, mimic = server.generate_dish_details("Pad Thai", pool=pool)
+
+    assert description == "Noodles."
+    assert healthy == server.empty_recipe("Healthy Version")
+    assert mimic == {"title": "Mimic"}
+    pool.shutdown(wait=False)